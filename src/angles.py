@@ -9,6 +9,7 @@ Created on Mon Aug 23 00:25:35 2021
 import os
 import math
 import cv2
+import numpy as np
 
 # ------------------------------
 # Frame Angles and Distance
@@ -24,7 +25,13 @@ class Frame_Angles:
     # Set the angle width (and angle height if it is disproportional).
     # These can be set during init, or afterwards.
 
+    # Or set a calibrated pinhole model with set_camera_matrix(fx,fy,cx,cy)
+    # (e.g. the rectified projection P1 of calibration.StereoRectifier),
+    # which replaces the angle width/height and the frame center.
+
     # Run build_frame.
+    # Run build_frame(angle_tables=True) to also precompute per-column and per-row angles,
+    # then angles_from_table(xy) converts (N,2) top left pixels to angles by table lookup.
 
     # Use angles_from_center(self,x,y,top_left=True,degrees=True) to get x,y angles from center.
     # If top_left is True, input x,y pixels are measured from the top left of frame.
@@ -50,6 +57,9 @@ class Frame_Angles:
     angle_width = 60
     angle_height = None
 
+    # (fx,fy,cx,cy) pixels, None: nominal model from the angles
+    camera_matrix = None
+
     # ------------------------------
     # System Variables
     # ------------------------------
@@ -60,6 +70,10 @@ class Frame_Angles:
     x_adjacent = None
     x_adjacent = None
 
+    # per-column and per-row angle tables (radians), see build_frame
+    x_angle_table = None
+    y_angle_table = None
+
     # ------------------------------
     # Init Functions
     # ------------------------------
@@ -81,23 +95,64 @@ class Frame_Angles:
         # do initial setup
         self.build_frame()
 
-    def build_frame(self):
+    def build_frame(self,angle_tables=False):
 
         # this assumes correct values for pixel_width, pixel_height, and angle_width
-
-        # fix angle height
-        if not self.angle_height:
-            self.angle_height = self.angle_width*(self.pixel_height/self.pixel_width)
-
-        # center point (also max pixel distance from origin)
-        self.x_origin = int(self.pixel_width/2)
-        self.y_origin = int(self.pixel_height/2)
-
-        # theoretical distance in pixels from camera to frame
-        # this is the adjacent-side length in tangent calculations
-        # the pixel x,y inputs is the opposite-side lengths
-        self.x_adjacent = self.x_origin / math.tan(math.radians(self.angle_width/2))
-        self.y_adjacent = self.y_origin / math.tan(math.radians(self.angle_height/2))
+        # if angle_tables is True, also precompute the angle of every pixel
+        # column and row (used by angles_from_table)
+
+        if self.camera_matrix is not None:
+
+            # calibrated model: focal lengths and principal point
+            fx,fy,cx,cy = self.camera_matrix
+            self.x_origin = float(cx)
+            self.y_origin = float(cy)
+            self.x_adjacent = float(fx)
+            self.y_adjacent = float(fy)
+
+            # equivalent field of view (informative)
+            self.angle_width = math.degrees(2*math.atan(self.pixel_width/2/fx))
+            self.angle_height = math.degrees(2*math.atan(self.pixel_height/2/fy))
+
+        else:
+
+            # fix angle height
+            if not self.angle_height:
+                self.angle_height = self.angle_width*(self.pixel_height/self.pixel_width)
+
+            # center point (also max pixel distance from origin)
+            self.x_origin = int(self.pixel_width/2)
+            self.y_origin = int(self.pixel_height/2)
+
+            # theoretical distance in pixels from camera to frame
+            # this is the adjacent-side length in tangent calculations
+            # the pixel x,y inputs is the opposite-side lengths
+            self.x_adjacent = self.x_origin / math.tan(math.radians(self.angle_width/2))
+            self.y_adjacent = self.y_origin / math.tan(math.radians(self.angle_height/2))
+
+        # pixel-to-angle tables, one entry per pixel edge (0..width, 0..height)
+        # measured from the top left, same as angles_from_center(top_left=True)
+        if angle_tables:
+            columns = np.arange(self.pixel_width+1,dtype=np.float64)
+            rows = np.arange(self.pixel_height+1,dtype=np.float64)
+            self.x_angle_table = np.arctan((columns-self.x_origin)/self.x_adjacent)
+            self.y_angle_table = np.arctan((self.y_origin-rows)/self.y_adjacent)
+            self.x_angle_slope = np.diff(self.x_angle_table)
+            self.y_angle_slope = np.diff(self.y_angle_table)
+        else:
+            self.x_angle_table = None
+            self.y_angle_table = None
+
+    def set_camera_matrix(self,fx,fy,cx,cy,angle_tables=False):
+
+        # calibrated pinhole model instead of the nominal field of view
+        # (None to go back to it), the frame is built again
+
+        if fx is None:
+            self.camera_matrix = None
+        else:
+            self.camera_matrix = (fx,fy,cx,cy)
+        self.build_frame(angle_tables=angle_tables)
 
     # ------------------------------
     # Pixels-to-Angles Functions
@@ -232,6 +287,150 @@ class Frame_Angles:
         # done
         return X,Y,Z,D
 
+    # ------------------------------
+    # Array Functions
+    # ------------------------------
+
+    # Same as the scalar functions above, but for (N,2) arrays of points,
+    # so a whole set of landmarks is handled in one NumPy call.
+
+    def angles_from_center_array(self,xy,top_left=True,degrees=True):
+
+        # xy = (N,2) array of x,y pixels
+        # returns (N,2) array of x,y angles from center
+
+        xy = np.asarray(xy,dtype=np.float64).reshape(-1,2)
+
+        x = xy[:,0]
+        y = xy[:,1]
+
+        if top_left:
+            x = x - self.x_origin
+            y = self.y_origin - y
+
+        angles = np.empty_like(xy)
+        np.arctan(x/self.x_adjacent,out=angles[:,0])
+        np.arctan(y/self.y_adjacent,out=angles[:,1])
+
+        if degrees:
+            np.degrees(angles,out=angles)
+
+        return angles
+
+    def angles_from_table(self,xy,degrees=True):
+
+        # table version of angles_from_center_array (top_left pixels only)
+        # needs build_frame(angle_tables=True)
+        # sub-pixel positions are linearly interpolated between table entries
+        # points off the frame (ROI crops, optical flow, rectified points)
+        # use the exact arctan, the table can not be extrapolated
+
+        xy = np.asarray(xy,dtype=np.float64).reshape(-1,2)
+
+        angles = np.empty_like(xy)
+        for axis,table,slope in ((0,self.x_angle_table,self.x_angle_slope),
+                                 (1,self.y_angle_table,self.y_angle_slope)):
+            pos = xy[:,axis]
+            index = np.clip(pos.astype(np.intp),0,slope.shape[0]-1)
+            angles[:,axis] = table[index] + (pos-index)*slope[index]
+
+            outside = (pos < 0) | (pos > slope.shape[0])
+            if outside.any():
+                if axis == 0:
+                    angles[outside,0] = np.arctan(
+                        (pos[outside]-self.x_origin)/self.x_adjacent)
+                else:
+                    angles[outside,1] = np.arctan(
+                        (self.y_origin-pos[outside])/self.y_adjacent)
+
+        if degrees:
+            np.degrees(angles,out=angles)
+
+        return angles
+
+    def intersection_array(self,pdistance,langles,rangles,degrees=False):
+
+        # array version of intersection
+        # langles,rangles = (N,) arrays of left/right camera x angles
+        # returns (N,2) array of X,Y
+
+        langles = np.asarray(langles,dtype=np.float64)
+        rangles = np.asarray(rangles,dtype=np.float64)
+
+        if degrees:
+            langles = np.radians(langles)
+            rangles = np.radians(rangles)
+
+        # 1/tan(pi/2 - a) = tan(a) and 1/tan(pi/2 + a) = -tan(a)
+        ltan_inv = np.tan(langles)
+        rtan_inv = -np.tan(rangles)
+
+        XY = np.empty((langles.shape[0],2))
+        XY[:,1] = pdistance / ( ltan_inv + rtan_inv )
+        XY[:,0] = XY[:,1] * ltan_inv
+
+        return XY
+
+    def location_array(self,pdistance,lcamera,rcamera,center=False,degrees=True):
+
+        # array version of location
+        # lcamera,rcamera = (N,2) arrays of (Xangle,Yangle) to each target
+        # returns (N,4) array of X,Y,Z,D
+
+        lcamera = np.asarray(lcamera,dtype=np.float64).reshape(-1,2)
+        rcamera = np.asarray(rcamera,dtype=np.float64).reshape(-1,2)
+
+        lxangle = lcamera[:,0]
+        rxangle = rcamera[:,0]
+
+        # yangle should be the same for both cameras (if aligned correctly)
+        yangle = (lcamera[:,1]+rcamera[:,1])/2
+
+        if degrees:
+            lxangle = np.radians(lxangle)
+            rxangle = np.radians(rxangle)
+            yangle  = np.radians(yangle)
+
+        XYZD = np.empty((lcamera.shape[0],4))
+
+        # get X,Z (remember Y for the intersection is Z frame)
+        XZ = self.intersection_array(pdistance,lxangle,rxangle,degrees=False)
+        XYZD[:,0] = XZ[:,0]
+        XYZD[:,2] = XZ[:,1]
+
+        # get Y
+        XYZD[:,1] = np.tan(yangle) * np.hypot(XZ[:,0],XZ[:,1])
+
+        # baseline-center instead of left-camera-center
+        if center:
+            XYZD[:,0] -= pdistance/2
+
+        # get 3D distance
+        XYZD[:,3] = np.sqrt(np.einsum('ij,ij->i',XYZD[:,:3],XYZD[:,:3]))
+
+        return XYZD
+
+    def locations_from_pixels(self,pdistance,lpixels,rpixels,center=False):
+
+        # lpixels,rpixels = (N,2) arrays of matching x,y pixels (top left)
+        # in the left and right camera frames
+        # returns (N,4) array of X,Y,Z,D
+
+        # use the angle tables if build_frame made them
+        if self.x_angle_table is not None:
+            langles = self.angles_from_table(lpixels,degrees=False)
+            rangles = self.angles_from_table(rpixels,degrees=False)
+        else:
+            langles = self.angles_from_center_array(lpixels,top_left=True,degrees=False)
+            rangles = self.angles_from_center_array(rpixels,top_left=True,degrees=False)
+
+        return self.location_array(
+            pdistance,
+            langles,
+            rangles,
+            center=center,
+            degrees=False)
+
     # ------------------------------
     # Tertiary Functions
     # ------------------------------
@@ -240,30 +439,36 @@ class Frame_Angles:
 
         # add crosshairs to frame to aid in aligning
 
-        cv2.line(frame,(0,self.y_origin),(self.pixel_width,self.y_origin),(0,255,0),1)
-        cv2.line(frame,(self.x_origin,0),(self.x_origin,self.pixel_height),(0,255,0),1)
+        x_origin = int(round(self.x_origin))
+        y_origin = int(round(self.y_origin))
+
+        cv2.line(frame,(0,y_origin),(self.pixel_width,y_origin),(0,255,0),1)
+        cv2.line(frame,(x_origin,0),(x_origin,self.pixel_height),(0,255,0),1)
 
-        cv2.circle(frame,(self.x_origin,self.y_origin),int(round(self.y_origin/8,0)),(0,255,0),1)
+        cv2.circle(frame,(x_origin,y_origin),int(round(y_origin/8,0)),(0,255,0),1)
 
     def frame_add_degrees(self,frame):
 
         # add lines to frame every 10 degrees (horizontally and vertically)
         # use this to test that your angle values are set up properly
 
+        x_origin = int(round(self.x_origin))
+        y_origin = int(round(self.y_origin))
+
         for angle in range(10,95,10):
 
             # calculate pixel offsets
             x,y = self.pixels_from_center(angle,angle)
 
             # draw verticals
-            if x <= self.x_origin:
-                cv2.line(frame,(self.x_origin-x,0),(self.x_origin-x,self.pixel_height),(255,0,255),1)
-                cv2.line(frame,(self.x_origin+x,0),(self.x_origin+x,self.pixel_height),(255,0,255),1)
+            if x <= x_origin:
+                cv2.line(frame,(x_origin-x,0),(x_origin-x,self.pixel_height),(255,0,255),1)
+                cv2.line(frame,(x_origin+x,0),(x_origin+x,self.pixel_height),(255,0,255),1)
 
             # draw horizontals
-            if y <= self.y_origin:
-                cv2.line(frame,(0,self.y_origin-y),(self.pixel_width,self.y_origin-y),(255,0,255),1)
-                cv2.line(frame,(0,self.y_origin+y),(self.pixel_width,self.y_origin+y),(255,0,255),1)
+            if y <= y_origin:
+                cv2.line(frame,(0,y_origin-y),(self.pixel_width,y_origin-y),(255,0,255),1)
+                cv2.line(frame,(0,y_origin+y),(self.pixel_width,y_origin+y),(255,0,255),1)
 
     def frame_make_target(self,outfilename='targeting_angles_frame_target.svg',openfile=False):
 
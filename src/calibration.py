@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 13:05:48 2026
+
+Stereo camera calibration.
+
+1. Calibration (offline): finds the chessboard corners of the image pairs in
+   camcalibration/images/stereoL and stereoR (in parallel, one process per
+   image), calibrates each camera, then the stereo pair, and saves the
+   parameters in a compact .npz file:
+
+       $ python src/calibration.py
+
+2. Rectification (at startup): StereoRectifier loads the .npz file, builds
+   the initUndistortRectifyMap maps once, in fixed point (CV_16SC2), and
+   undistortRectify remaps the frames with cv2.remap.
+
+   To rectify only what triangulation needs, rectify_points_left/right
+   undistort and rectify (N,2) arrays of landmark pixels with a single
+   cv2.undistortPoints call, leaving the frames untouched.
+
+Fuentes:
+    Nicolai Høirup Nielsen  (The Coding Lib)
+    https://github.com/niconielsen32/ComputerVision/tree/master/StereoVisionDepthEstimation
+
+    Daniel Lee
+    https://erget.wordpress.com/2014/02/01/calibrating-a-stereo-camera-with-opencv/
+
+@author: mherrera
+"""
+
+import os
+import glob
+import concurrent.futures
+import cv2
+import numpy as np
+
+# ------------------------------
+# Calibration
+# ------------------------------
+
+CALIBRATION_DIR = os.path.normpath(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'camcalibration'))
+
+CALIBRATION_FILE = os.path.join(CALIBRATION_DIR, 'stereo_calibration.npz')
+
+# inner corners of the chessboard (10x7 squares)
+CHESSBOARD_SIZE = (9, 6)
+
+CORNERS_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER,
+                    30, 0.001)
+
+
+def find_corners(image_file, chessboard_size=CHESSBOARD_SIZE):
+    # (image size, sub-pixel corners) or (image size, None) if not found
+    gray = cv2.imread(image_file, cv2.IMREAD_GRAYSCALE)
+    image_size = (gray.shape[1], gray.shape[0])
+
+    found, corners = cv2.findChessboardCorners(
+        gray, chessboard_size,
+        flags=cv2.CALIB_CB_ADAPTIVE_THRESH + cv2.CALIB_CB_NORMALIZE_IMAGE)
+    if not found:
+        return image_size, None
+
+    corners = cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1),
+                               CORNERS_CRITERIA)
+    return image_size, corners
+
+
+def calibrate(left_dir=os.path.join(CALIBRATION_DIR, 'images', 'stereoL'),
+              right_dir=os.path.join(CALIBRATION_DIR, 'images', 'stereoR'),
+              out_file=CALIBRATION_FILE,
+              chessboard_size=CHESSBOARD_SIZE,
+              square_size=2.5,  # cms
+              workers=None):
+
+    left_files = sorted(glob.glob(os.path.join(left_dir, '*.png')))
+    right_files = sorted(glob.glob(os.path.join(right_dir, '*.png')))
+    if len(left_files) != len(right_files):
+        raise ValueError('left/right image count differ: {}/{}'.format(
+            len(left_files), len(right_files)))
+
+    # corner detection is the slow part, one image per process
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        left_corners = list(executor.map(
+            find_corners, left_files,
+            [chessboard_size] * len(left_files)))
+        right_corners = list(executor.map(
+            find_corners, right_files,
+            [chessboard_size] * len(right_files)))
+
+    image_size = left_corners[0][0]
+
+    # chessboard corners in chessboard coordinates
+    board = np.zeros((chessboard_size[0] * chessboard_size[1], 3),
+                     np.float32)
+    board[:, :2] = np.mgrid[0:chessboard_size[0],
+                            0:chessboard_size[1]].T.reshape(-1, 2)
+    board *= square_size
+
+    # only the pairs with the chessboard found in both images
+    object_points = []
+    left_points = []
+    right_points = []
+    for (_, left), (_, right) in zip(left_corners, right_corners):
+        if left is not None and right is not None:
+            object_points.append(board)
+            left_points.append(left)
+            right_points.append(right)
+    print('calibration:pairs:{}/{}'.format(len(object_points),
+                                           len(left_files)))
+
+    # each camera
+    left_error, left_matrix, left_dist, _, _ = cv2.calibrateCamera(
+        object_points, left_points, image_size, None, None)
+    right_error, right_matrix, right_dist, _, _ = cv2.calibrateCamera(
+        object_points, right_points, image_size, None, None)
+    print('calibration:left rms:{:.3f} right rms:{:.3f}'.format(
+        left_error, right_error))
+
+    # stereo pair (intrinsics fixed)
+    stereo_error, left_matrix, left_dist, right_matrix, right_dist, \
+        R, T, _, _ = cv2.stereoCalibrate(
+            object_points, left_points, right_points,
+            left_matrix, left_dist, right_matrix, right_dist,
+            image_size,
+            criteria=CORNERS_CRITERIA,
+            flags=cv2.CALIB_FIX_INTRINSIC)
+    print('calibration:stereo rms:{:.3f}'.format(stereo_error))
+
+    R1, R2, P1, P2, Q, _, _ = cv2.stereoRectify(
+        left_matrix, left_dist, right_matrix, right_dist,
+        image_size, R, T, alpha=0)
+
+    np.savez_compressed(
+        out_file,
+        image_size=np.array(image_size),
+        left_matrix=left_matrix, left_dist=left_dist,
+        right_matrix=right_matrix, right_dist=right_dist,
+        R=R, T=T, R1=R1, R2=R2, P1=P1, P2=P2, Q=Q,
+        rms=np.array([left_error, right_error, stereo_error]))
+    print('calibration:saved:{}'.format(out_file))
+
+# ------------------------------
+# Rectification
+# ------------------------------
+
+
+class StereoRectifier:
+
+    def __init__(self, calibration_file=CALIBRATION_FILE):
+
+        with np.load(calibration_file) as calibration:
+            self.calibration = {key: calibration[key]
+                                for key in calibration.files}
+
+        self.image_size = tuple(int(v)
+                                for v in self.calibration['image_size'])
+
+        # fixed point maps (CV_16SC2): smaller and faster remap than float
+        self.left_map = cv2.initUndistortRectifyMap(
+            self.calibration['left_matrix'], self.calibration['left_dist'],
+            self.calibration['R1'], self.calibration['P1'],
+            self.image_size, cv2.CV_16SC2)
+        self.right_map = cv2.initUndistortRectifyMap(
+            self.calibration['right_matrix'], self.calibration['right_dist'],
+            self.calibration['R2'], self.calibration['P2'],
+            self.image_size, cv2.CV_16SC2)
+
+        # camera matrix, distortion, rectification and projection
+        self.left_points_params = (
+            self.calibration['left_matrix'], self.calibration['left_dist'],
+            self.calibration['R1'], self.calibration['P1'])
+        self.right_points_params = (
+            self.calibration['right_matrix'], self.calibration['right_dist'],
+            self.calibration['R2'], self.calibration['P2'])
+
+    def rectified_camera(self, flipped=False):
+        # (fx, fy, cx, cy, baseline) of the rectified frames and points:
+        # both cameras share P1's intrinsics after stereoRectify, the
+        # baseline (cms) is the x translation of P2
+        # flipped: principal point in frames flipped with cv2.flip(-1)
+        P1 = self.calibration['P1']
+        P2 = self.calibration['P2']
+        fx, fy = float(P1[0, 0]), float(P1[1, 1])
+        cx, cy = float(P1[0, 2]), float(P1[1, 2])
+        if flipped:
+            cx = self.image_size[0] - 1 - cx
+            cy = self.image_size[1] - 1 - cy
+        baseline = abs(float(P2[0, 3]) / float(P2[0, 0]))
+        return fx, fy, cx, cy, baseline
+
+    def rectify_left(self, frame, dst=None):
+        return cv2.remap(frame, self.left_map[0], self.left_map[1],
+                         cv2.INTER_LINEAR, dst=dst)
+
+    def rectify_right(self, frame, dst=None):
+        return cv2.remap(frame, self.right_map[0], self.right_map[1],
+                         cv2.INTER_LINEAR, dst=dst)
+
+    def undistortRectify(self, frame_left, frame_right):
+        return self.rectify_left(frame_left), self.rectify_right(frame_right)
+
+    def rectify_points(self, points, points_params, flipped=False):
+        # (N,2) raw pixels -> (N,2) rectified pixels
+        # flipped: the points come from a frame flipped with cv2.flip(-1)
+        # (selfie point of view), the result is flipped back the same way
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 1, 2)
+        if points.shape[0] == 0:
+            return points.reshape(0, 2)
+
+        last_x = self.image_size[0] - 1
+        last_y = self.image_size[1] - 1
+        if flipped:
+            points = np.array((last_x, last_y)) - points
+
+        matrix, dist, R, P = points_params
+        points = cv2.undistortPoints(points, matrix, dist, R=R, P=P)
+
+        if flipped:
+            points = np.array((last_x, last_y)) - points
+        return points.reshape(-1, 2)
+
+    def rectify_points_left(self, points, flipped=False):
+        return self.rectify_points(points, self.left_points_params, flipped)
+
+    def rectify_points_right(self, points, flipped=False):
+        return self.rectify_points(points, self.right_points_params, flipped)
+
+
+def load(calibration_file=CALIBRATION_FILE):
+    # StereoRectifier, None if there is no calibration file
+    if not os.path.isfile(calibration_file):
+        print('calibration:not found:{}'.format(calibration_file))
+        return None
+    return StereoRectifier(calibration_file)
+
+
+if __name__ == '__main__':
+    calibrate()
@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 19:20:31 2026
+
+Camera capture + hand detection in its own process.
+
+With threads, both MediaPipe graphs, the key mapping, the drawing and the
+synth share one interpreter (GIL). A DetectionProcess runs the VideoThread,
+the preprocessing (rectification, flip) and the HandDetector of one camera
+in a child process, and hands the results over in shared memory, without
+pickling:
+
+    FrameRing   the preprocessed frames (for the preview only)
+    ResultRing  the landmarks and handedness of each frame, in the slot with
+                the same index, committed with the frame sequence number
+
+The consumer copies the landmarks (a few hundred bytes) and checks that the
+slot was not rewritten meanwhile (sequence numbers, see frame_ring). With
+lossless (replays) the child waits for the consumer (credits semaphore)
+instead of overwriting results not read yet.
+
+Startup: start() and wait_ready() (camera open and first frame, detector
+built). Shutdown: stop() sets the stop event, merges the stage profile of
+the child into the parent profiler, joins the child (terminated if it does
+not exit) and frees the shared memory. The child is a daemon and also stops
+when the parent is gone, so an interrupted parent does not leave it behind.
+
+@author: mherrera
+"""
+import time
+import queue
+import signal
+import traceback
+import multiprocessing
+from multiprocessing import shared_memory
+import cv2
+import numpy as np
+from frame_ring import FrameRing
+from detection_thread import DetectionResult
+
+# ------------------------------
+# Result Ring
+# ------------------------------
+
+# detection stats shared by the child
+STATS = ['frame_rate', 'inferred', 'propagated', 'interval']
+
+
+class ResultRing:
+
+    def __init__(self, n_slots, max_hands=2, name=None, create=True):
+
+        self.n_slots = n_slots
+        self.max_hands = max_hands
+
+        # stats, hands per slot, landmarks per slot, handedness per slot
+        shapes = [((len(STATS),), np.float64),
+                  ((n_slots,), np.int64),
+                  ((n_slots, max_hands, 21, 3), np.float32),
+                  ((n_slots, max_hands, 2), np.float32)]
+        sizes = [int(np.prod(shape)) * np.dtype(dtype).itemsize
+                 for shape, dtype in shapes]
+
+        self.shm = shared_memory.SharedMemory(name=name, create=create,
+                                              size=sum(sizes))
+        self.name = self.shm.name
+        self.owner = create
+
+        arrays = []
+        offset = 0
+        for (shape, dtype), size in zip(shapes, sizes):
+            arrays.append(np.ndarray(shape, dtype=dtype, buffer=self.shm.buf,
+                                     offset=offset))
+            offset += size
+        self.stats, self.n_hands, self.landmarks, self.handedness = arrays
+        if create:
+            self.stats[:] = 0
+            self.n_hands[:] = 0
+
+    @classmethod
+    def attach(cls, name, n_slots, max_hands):
+        # open a ring created by another process
+        return cls(n_slots, max_hands=max_hands, name=name, create=False)
+
+    def write(self, index, landmarks, handedness):
+        n_hands = landmarks.shape[0]
+        self.landmarks[index, :n_hands] = landmarks
+        self.handedness[index, :n_hands] = handedness
+        self.n_hands[index] = n_hands
+
+    def read(self, index):
+        # copies of the landmarks and handedness of a slot
+        n_hands = int(self.n_hands[index])
+        return (self.landmarks[index, :n_hands].copy(),
+                self.handedness[index, :n_hands].copy())
+
+    def close(self):
+        self.stats = None
+        self.n_hands = None
+        self.landmarks = None
+        self.handedness = None
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+            self.owner = False
+
+# ------------------------------
+# Child process
+# ------------------------------
+
+
+def detection_worker(name, video_config, detector_config, rectify,
+                     frames_name, results_name, frame_shape, n_slots,
+                     max_hands, profile, ready, stop, new_result, finished,
+                     credits, profile_queue):
+
+    # imported here: only the child needs mediapipe and the camera
+    import video_thread
+    import handdetector
+    import calibration
+    import profiler
+
+    # shutdown is coordinated by the parent (stop event), not by Ctrl-C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # the parent, to stop if it is gone
+    parent = multiprocessing.parent_process()
+
+    video = None
+    frames = None
+    results = None
+    stage_profiler = profiler.StageProfiler(enabled=profile)
+    try:
+        frames = FrameRing.attach(frames_name, frame_shape, n_slots)
+        results = ResultRing.attach(results_name, n_slots, max_hands)
+
+        # rectification ('left', 'right' or None) before the flip
+        rectify_frame = None
+        rectified = None
+        if rectify is not None:
+            stereo_rectifier = calibration.load()
+            if stereo_rectifier is not None:
+                rectify_frame = getattr(stereo_rectifier,
+                                        'rectify_' + rectify)
+                rectified = np.zeros(frame_shape, np.uint8)
+
+        detector = handdetector.HandDetector(**detector_config['init'])
+        if detector_config.get('roi') is not None:
+            detector.setRoi(**detector_config['roi'])
+        if detector_config.get('frame_skipping') is not None:
+            detector.setFrameSkipping(**detector_config['frame_skipping'])
+
+        video = video_thread.VideoThread(profiler=stage_profiler,
+                                         profile_name=name + '.capture',
+                                         **video_config)
+        video.start()
+        video.wait_first_frame(timeout=5)
+        ready.set()
+
+        while not stop.is_set() and parent.is_alive():
+            video_finished, timestamp, frame = video.next_with_timestamp(
+                black=False, wait=0.5)
+            if video_finished:
+                break
+            if frame is None:
+                continue
+
+            # lossless: wait until the consumer frees a slot
+            if credits is not None:
+                while not credits.acquire(timeout=0.5):
+                    if stop.is_set() or not parent.is_alive():
+                        stop.set()
+                        break
+                if stop.is_set():
+                    break
+
+            # preprocess into the ring slot
+            with stage_profiler.span(name + '.preprocess'):
+                index, slot = frames.write_slot()
+                if rectify_frame is not None:
+                    frame = rectify_frame(frame, dst=rectified)
+                if frame.shape != slot.shape:
+                    frame = cv2.resize(frame, (slot.shape[1], slot.shape[0]))
+                cv2.flip(frame, -1, dst=slot)  # Selfie point of view
+
+            with stage_profiler.span(name + '.hands'):
+                detector.findHands(slot)
+
+            landmarks, handedness = detector.getLandmarks()
+            results.write(index, landmarks, handedness)
+            frames.commit(index, timestamp)
+            new_result.release()
+
+            detection_stats = detector.getFrameStats()
+            results.stats[:] = (video.current_frame_rate,
+                                detection_stats['inferred'],
+                                detection_stats['propagated'],
+                                detection_stats['interval'])
+
+    except Exception:
+        print('{}:{}'.format(name, traceback.format_exc()))
+
+    # shut down, the stage profile goes to the parent profiler
+    finished.set()
+    new_result.release()
+    if profile and parent.is_alive():
+        profile_queue.put(stage_profiler.stages)
+    if video is not None:
+        video.stop()
+    if frames is not None:
+        frames.close()
+    if results is not None:
+        results.close()
+
+# ------------------------------
+# Detection Process
+# ------------------------------
+
+
+class DetectionProcess:
+
+    def __init__(self,
+                 name,              # 'left' or 'right', also the profile
+                 video_config,      # video_thread.VideoThread kwargs
+                 detector_config,   # {'init': HandDetector kwargs,
+                                    #  'roi': setRoi kwargs or None,
+                                    #  'frame_skipping': kwargs or None}
+                 frame_shape,       # (height, width, 3)
+                 fingertips_index,  # HandDetector.fingerTipsIndex
+                 rectify=None,      # 'left', 'right' or None
+                 n_slots=12,
+                 lossless=False,
+                 profiler=None):    # profiler.StageProfiler, gets the
+                                    # <name>.capture/.preprocess/.hands
+                                    # stages of the child at stop()
+
+        self.name = name
+        self.frame_shape = tuple(frame_shape)
+        self.lossless = lossless
+        self.fingertips_index = np.asarray(fingertips_index, dtype=np.intp)
+        max_hands = detector_config['init'].get('maxHands', 2)
+
+        # spawn: a clean child, no copies of the parent threads or locks
+        context = multiprocessing.get_context('spawn')
+
+        # shared memory, owned (and unlinked) by this process
+        self.frames = FrameRing(self.frame_shape, n_slots=n_slots)
+        self.results = ResultRing(n_slots, max_hands=max_hands)
+
+        # the parent never waits on an Event: Event.set() blocks if a
+        # waiter died while waiting (the child would hang). New results are
+        # signaled with a semaphore (release never blocks), ready is polled
+        self.ready = context.Event()
+        self.stop_event = context.Event()
+        self.new_result = context.Semaphore(0)
+        self.finished_event = context.Event()
+        self.credits = context.Semaphore(n_slots - 2) if lossless else None
+
+        self.profiler = profiler
+        profile = profiler is not None and profiler.enabled
+        self.profile_queue = context.Queue() if profile else None
+
+        # daemon: terminated if the parent exits without stop()
+        self.process = context.Process(
+            target=detection_worker,
+            name='detection-' + name,
+            args=(name, video_config, detector_config, rectify,
+                  self.frames.name, self.results.name, self.frame_shape,
+                  n_slots, max_hands, profile, self.ready, self.stop_event,
+                  self.new_result, self.finished_event, self.credits,
+                  self.profile_queue),
+            daemon=True)
+
+        # last sequence returned
+        self.last_seq = -1
+        self.frames_returned = 0
+
+        # black frame (filler)
+        self.black_frame = np.zeros(self.frame_shape, np.uint8)
+        self.black_frame.flags.writeable = False
+
+    def start(self):
+        self.process.start()
+
+    def wait_ready(self, timeout=None):
+        # True when the camera and the detector of the child are up
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.ready.is_set():
+            time.sleep(0.05)
+            if not self.process.is_alive():
+                return False
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+        return True
+
+    def stop(self, timeout=5):
+        self.stop_event.set()
+        if self.process.pid is not None:
+            # the profile first: a child with queued data does not exit
+            # before it is read
+            if self.profile_queue is not None:
+                self.receive_profile(timeout)
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+        self.frames.close()
+        self.results.close()
+
+    def receive_profile(self, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                stages = self.profile_queue.get(timeout=0.1)
+            except queue.Empty:
+                if self.process.is_alive():
+                    continue
+                try:
+                    stages = self.profile_queue.get_nowait()
+                except queue.Empty:
+                    return
+            self.profiler.merge(stages)
+            return
+
+    @property
+    def current_frame_rate(self):
+        return float(self.results.stats[0])
+
+    @property
+    def skip_interval(self):
+        return int(self.results.stats[3])
+
+    def getFrameStats(self):
+        # frames with mediapipe inference and with propagated landmarks
+        stats = self.results.stats
+        return {'inferred': int(stats[1]),
+                'propagated': int(stats[2]),
+                'interval': int(stats[3])}
+
+    def read(self, seq):
+        # DetectionResult of frame seq, None if it was rewritten meanwhile
+        index = seq % self.frames.n_slots
+        frame = self.frames.get(seq)
+        timestamp = self.frames.timestamp(seq)
+        landmarks, handedness = self.results.read(index)
+        if frame is None or timestamp is None or \
+                not self.frames.is_valid(seq):
+            return None
+
+        # same rows as HandDetector.getFingerTipsArray
+        tips = self.fingertips_index
+        n_hands = landmarks.shape[0]
+        fingertips = np.zeros((n_hands * len(tips), 4))
+        fingertips[:, 0] = np.repeat(np.arange(n_hands), len(tips))
+        fingertips[:, 1] = np.tile(tips, n_hands)
+        fingertips[:, 2:4] = landmarks[:, tips, :2].reshape(-1, 2)
+
+        return DetectionResult(timestamp, seq, frame, n_hands > 0,
+                               landmarks, handedness, fingertips)
+
+    def next_with_timestamp(self, wait=0):
+        # (finished, timestamp, DetectionResult): the latest result (the
+        # next one with lossless), None if there is none in wait seconds
+
+        deadline = time.monotonic() + wait
+        while True:
+            # pending signals out first, a result committed after the
+            # check below signals again
+            while self.new_result.acquire(False):
+                pass
+            last = self.frames.last_seq()
+            if last > self.last_seq:
+                seq = self.last_seq + 1 if self.lossless else last
+                result = self.read(seq)
+                self.last_seq = seq
+                if self.credits is not None:
+                    self.credits.release()
+                if result is not None:
+                    self.frames_returned += 1
+                    return False, result.timestamp, result
+                continue
+
+            if self.finished_event.is_set():
+                return True, None, None
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False, None, None
+            self.new_result.acquire(timeout=remaining)
+
+    def next(self, wait=0):
+        finished, _, result = self.next_with_timestamp(wait)
+        return finished, result
+
+    def empty_result(self):
+        # no detection, black frame (filler)
+        return DetectionResult(time.monotonic(), self.last_seq,
+                               self.black_frame, False,
+                               np.zeros((0, 21, 3), np.float32),
+                               np.zeros((0, 2), np.float32),
+                               np.zeros((0, 4)))
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 10:12:41 2026
+
+Hand detection worker: runs a HandDetector over the frames of a VideoThread
+in its own thread, so the detection of both cameras overlaps. The main loop
+only takes the latest result of each worker.
+
+@author: mherrera
+"""
+import time
+import threading
+import queue
+import collections
+import numpy as np
+from profiler import StageProfiler
+
+# ------------------------------
+# Detection Result
+# ------------------------------
+
+DetectionResult = collections.namedtuple(
+    'DetectionResult',
+    ['timestamp',     # capture time.monotonic() of the frame
+     'frame_number',  # frames processed by the worker
+     'frame',         # preprocessed frame (owned by the result)
+     'found',         # any hand found
+     'landmarks',     # (hands, 21, 3) landmarks, for drawHands/drawTips
+     'handedness',    # (hands, 2) 1.0 right/0.0 left, score
+     'fingertips'])   # (hands*5, 4) [hand_id, tip_id, cx, cy] rows
+
+# ------------------------------
+# Detection Tread
+# ------------------------------
+
+
+class DetectionThread:
+
+    def __init__(self,
+                 detector,          # handdetector.HandDetector
+                 video,             # video_thread.VideoThread
+                 preprocess=None,   # frame -> frame, e.g. flip
+                 frame_wait=0.5,
+                 profiler=None,     # profiler.StageProfiler
+                 profile_name='detection'):
+
+        self.detector = detector
+        self.video = video
+        self.preprocess = preprocess
+        self.frame_wait = frame_wait
+
+        # <profile_name>.preprocess/.hands stages
+        self.profiler = profiler
+        if self.profiler is None:
+            self.profiler = StageProfiler(enabled=False)
+        self.preprocess_stage = profile_name + '.preprocess'
+        self.hands_stage = profile_name + '.hands'
+
+        # control states
+        self.detection_run = False
+        self.detection_on = False
+        self.finished = False
+
+        # counts
+        self.frame_count = 0
+        self.frames_returned = 0
+        # shared frames rewritten by the camera before being copied
+        self.frames_stale = 0
+
+        # last result only
+        self.buffer = queue.Queue(1)
+
+        self.thread = None
+
+    def process(self, frame, timestamp=None, frame_seq=None):
+        # detect hands in one frame (also usable without the thread)
+        # frame_seq: ring sequence of a shared frame view of the video, None
+        # is returned if the camera rewrote its slot before it was copied
+
+        if timestamp is None:
+            timestamp = time.monotonic()
+        if self.preprocess is not None:
+            with self.profiler.span(self.preprocess_stage):
+                frame = self.preprocess(frame)
+            if not self.is_frame_valid(frame_seq):
+                return None
+
+        with self.profiler.span(self.hands_stage):
+            found = self.detector.findHands(frame)
+        if self.preprocess is None and not self.is_frame_valid(frame_seq):
+            # detected on the view itself
+            return None
+
+        # the detector arrays are reused on the next frame
+        landmarks, handedness = self.detector.getLandmarks()
+        fingertips = self.detector.getFingerTipsArray()
+
+        self.frame_count += 1
+        return DetectionResult(timestamp, self.frame_count, frame, found,
+                               landmarks.copy(), handedness.copy(),
+                               fingertips.copy())
+
+    def is_frame_valid(self, frame_seq):
+        if frame_seq is None or self.video.is_frame_valid(frame_seq):
+            return True
+        self.frames_stale += 1
+        return False
+
+    def empty_result(self):
+        # no detection, black frame (filler)
+        return DetectionResult(time.monotonic(), self.frame_count,
+                               self.video.black_frame.copy(), False,
+                               np.zeros((0, 21, 3), np.float32),
+                               np.zeros((0, 2), np.float32),
+                               np.zeros((0, 4)))
+
+    def start(self):
+
+        # set run state
+        self.detection_run = True
+
+        # start thread
+        self.thread = threading.Thread(target=self.loop)
+        self.thread.start()
+
+    def stop(self):
+
+        # set loop kill state
+        self.detection_run = False
+
+        # let loop stop
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def loop(self):
+
+        # status
+        self.detection_on = True
+
+        while self.detection_run:
+            finished, timestamp, frame = self.video.next_with_timestamp(
+                black=False, wait=self.frame_wait)
+            if finished:
+                break
+            if frame is None:
+                continue
+
+            result = self.process(frame, timestamp, self.video.frame_seq)
+            if result is None:
+                continue
+
+            # keep only the latest result
+            if self.buffer.full():
+                try:
+                    self.buffer.get_nowait()
+                except queue.Empty:
+                    pass
+            self.buffer.put(result, False)
+
+        # shut down
+        self.detection_on = False
+        self.finished = True
+
+    def next(self, wait=0):
+
+        # latest detection result, None if there is none in wait seconds
+        result = None
+        if not self.buffer.empty() or self.detection_on:
+            try:
+                result = self.buffer.get(timeout=wait)
+                self.frames_returned += 1
+            except queue.Empty:
+                pass
+
+        return self.finished and self.buffer.empty(), result
+
+    def next_with_timestamp(self, wait=0):
+        # as next, plus the capture timestamp of the result
+        finished, result = self.next(wait)
+        timestamp = result.timestamp if result is not None else None
+        return finished, timestamp, result
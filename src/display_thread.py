@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 18:42:53 2026
+
+Preview window in its own thread, at most max_fps frames per second.
+
+The main loop hands over the data of its latest cycle with show(), which never
+blocks: an item not displayed yet is replaced (dropped). The thread composes
+the preview with the compose(item) -> image function, shows it and polls the
+keyboard, so a slow window (drag, compositor) does not delay the notes. All
+the HighGUI calls (window, imshow, waitKey) are made from this thread.
+
+@author: mherrera
+"""
+import time
+import threading
+import collections
+import cv2
+from profiler import StageProfiler
+
+
+class DisplayThread:
+
+    def __init__(self,
+                 window_name,
+                 compose,           # item -> image to show
+                 max_fps=30,
+                 position=None,     # (x, y) of the window
+                 profiler=None,     # profiler.StageProfiler
+                 profile_name='display'):
+
+        self.window_name = window_name
+        self.compose = compose
+        self.period = 1.0 / max_fps
+        self.position = position
+
+        # <profile_name>.compose/.show stages
+        self.profiler = profiler
+        if self.profiler is None:
+            self.profiler = StageProfiler(enabled=False)
+        self.compose_stage = profile_name + '.compose'
+        self.show_stage = profile_name + '.show'
+
+        # latest item only
+        self.latest = None
+        self.new_item = threading.Event()
+
+        # pressed keys (waitKey codes)
+        self.keys = collections.deque(maxlen=16)
+
+        # control states
+        self.display_run = False
+        self.closed = False
+        self.thread = None
+
+        # counts
+        self.frames_shown = 0
+        self.frames_dropped = 0
+
+    def show(self, item):
+        if self.latest is not None:
+            self.frames_dropped += 1
+        self.latest = item
+        self.new_item.set()
+
+    def next_key(self):
+        # next pressed key, None if there is none
+        try:
+            return self.keys.popleft()
+        except IndexError:
+            return None
+
+    def start(self):
+
+        # set run state
+        self.display_run = True
+
+        # start thread
+        self.thread = threading.Thread(target=self.loop)
+        self.thread.start()
+
+    def stop(self):
+
+        # set loop kill state
+        self.display_run = False
+        self.new_item.set()
+
+        # let loop stop
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def loop(self):
+
+        cv2.namedWindow(self.window_name)
+        if self.position is not None:
+            cv2.moveWindow(self.window_name, *self.position)
+
+        last_show = 0.0
+        while self.display_run:
+            # rate limit, then the latest item
+            wait = last_show + self.period - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self.new_item.wait(self.period)
+            self.new_item.clear()
+
+            item, self.latest = self.latest, None
+            if item is not None:
+                with self.profiler.span(self.compose_stage):
+                    image = self.compose(item)
+                with self.profiler.span(self.show_stage):
+                    cv2.imshow(self.window_name, image)
+                self.frames_shown += 1
+                last_show = time.monotonic()
+
+            # also keeps the window alive without new items
+            key = cv2.waitKey(1) & 0xFF
+            if key != 255:
+                self.keys.append(key)
+            if cv2.getWindowProperty(
+                    self.window_name, cv2.WND_PROP_VISIBLE) < 1:
+                self.closed = True
+                break
+
+        cv2.destroyWindow(self.window_name)
+        self.closed = True
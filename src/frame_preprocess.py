@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 18:10:26 2026
+
+Capture to detection preprocessing (optional rectification, then flip) into
+preallocated frames.
+
+Each camera owns a FramePreprocessor with a pool of destination frames used
+in turn, so the steady state does not allocate: cv2.remap and cv2.flip write
+into them with dst=. A returned frame is rewritten n_buffers calls later, so
+the pool must be larger than the frames alive at once (the one being
+detected, the latest result queue, the stereo pairing pending items and the
+one the main loop draws on).
+
+@author: mherrera
+"""
+import cv2
+import numpy as np
+
+
+class FramePreprocessor:
+
+    def __init__(self,
+                 frame_shape,       # (height, width, 3)
+                 flip_code=-1,      # cv2.flip code, None: no flip
+                 rectify=None,      # (frame, dst) -> frame, e.g.
+                                    # StereoRectifier.rectify_left
+                 n_buffers=8):
+
+        self.flip_code = flip_code
+        self.rectify = rectify
+        self.n_buffers = n_buffers
+
+        self.allocate(tuple(frame_shape))
+
+    def allocate(self, frame_shape):
+        self.frame_shape = frame_shape
+        self.buffers = np.zeros((self.n_buffers,) + frame_shape, np.uint8)
+        self.index = 0
+        # rectified frame, before the flip
+        self.rectified = np.zeros(frame_shape, np.uint8) \
+            if self.rectify is not None and self.flip_code is not None \
+            else None
+
+    def next_buffer(self):
+        buffer = self.buffers[self.index]
+        self.index = (self.index + 1) % self.n_buffers
+        return buffer
+
+    def __call__(self, frame):
+        if frame.shape != self.frame_shape:
+            # the camera gave another size
+            self.allocate(frame.shape)
+
+        dst = self.next_buffer()
+        if self.rectify is not None:
+            if self.flip_code is None:
+                return self.rectify(frame, dst=dst)
+            frame = self.rectify(frame, dst=self.rectified)
+        if self.flip_code is None:
+            dst[:] = frame
+            return dst
+        return cv2.flip(frame, self.flip_code, dst=dst)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 11:02:17 2026
+
+Ring of preallocated frame slots in shared memory.
+
+The capture thread decodes straight into a slot (write_slot + commit) and
+consumers, in this process or attached from another one, get read-only views
+of the slots, without copies. Every commit gets a sequence number, stored in
+the header next to the slot with its capture timestamp; a slot being rewritten
+has sequence -1, so a consumer can check with is_valid(seq) that the view it
+holds was not overwritten while it was using it.
+
+@author: mherrera
+"""
+from multiprocessing import shared_memory
+import numpy as np
+
+
+class FrameRing:
+
+    def __init__(self, frame_shape, n_slots=4, name=None, create=True):
+
+        self.frame_shape = tuple(frame_shape)
+        self.n_slots = n_slots
+
+        # header: sequence number of each slot + last committed sequence,
+        # then the timestamp of each slot
+        seq_size = np.dtype(np.int64).itemsize * (n_slots + 1)
+        header_size = seq_size + np.dtype(np.float64).itemsize * n_slots
+        frame_size = int(np.prod(self.frame_shape))
+
+        self.shm = shared_memory.SharedMemory(
+            name=name, create=create,
+            size=header_size + frame_size * n_slots)
+        self.name = self.shm.name
+        self.owner = create
+
+        self.header = np.ndarray((n_slots + 1,), dtype=np.int64,
+                                 buffer=self.shm.buf)
+        self.timestamps = np.ndarray((n_slots,), dtype=np.float64,
+                                     buffer=self.shm.buf, offset=seq_size)
+        self.frames = np.ndarray((n_slots,) + self.frame_shape,
+                                 dtype=np.uint8, buffer=self.shm.buf,
+                                 offset=header_size)
+        if create:
+            self.header[:] = -1
+            self.timestamps[:] = 0.0
+
+        # read-only views, made once
+        self.read_views = []
+        for slot in self.frames:
+            view = slot.view()
+            view.flags.writeable = False
+            self.read_views.append(view)
+
+    @classmethod
+    def attach(cls, name, frame_shape, n_slots):
+        # open a ring created by another process
+        return cls(frame_shape, n_slots=n_slots, name=name, create=False)
+
+    def last_seq(self):
+        return int(self.header[self.n_slots])
+
+    def write_slot(self):
+        # slot for the next frame, marked invalid until commit
+        index = (self.last_seq() + 1) % self.n_slots
+        self.header[index] = -1
+        return index, self.frames[index]
+
+    def commit(self, index, timestamp=0.0):
+        seq = self.last_seq() + 1
+        self.timestamps[index] = timestamp
+        self.header[index] = seq
+        self.header[self.n_slots] = seq
+        return seq
+
+    def is_valid(self, seq):
+        return seq >= 0 and self.header[seq % self.n_slots] == seq
+
+    def get(self, seq):
+        # read-only view of frame seq, None if it was already overwritten
+        if not self.is_valid(seq):
+            return None
+        return self.read_views[seq % self.n_slots]
+
+    def timestamp(self, seq):
+        # capture timestamp of frame seq, None if it was already overwritten
+        timestamp = float(self.timestamps[seq % self.n_slots])
+        if not self.is_valid(seq):
+            return None
+        return timestamp
+
+    def latest(self):
+        # (seq, read-only view) of the last committed frame
+        seq = self.last_seq()
+        return seq, self.get(seq)
+
+    def close(self):
+        self.read_views = []
+        self.header = None
+        self.timestamps = None
+        self.frames = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # a consumer still holds a view, the memory is freed with it
+            pass
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+            self.owner = False
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 14:31:09 2026
+
+Left/right hand correspondence between the two cameras.
+
+MediaPipe does not return the hands in the same order in both images (see
+handdetector), so the hands are matched by cost: with the cameras side by
+side (and rectified) the same hand has the same landmark rows in both
+images, so the cost is the mean vertical distance between the 21 landmarks,
+plus a penalty when the handedness labels differ. The assignment with the
+lowest total cost is chosen (at most 2x2 hands, so all are tried) and pairs
+over max_cost are dropped, so a hand seen by one camera only is ignored.
+
+@author: mherrera
+"""
+import itertools
+import numpy as np
+
+
+class HandMatcher:
+
+    def __init__(self,
+                 max_cost=60.0,     # pixels
+                 label_cost=40.0):  # pixels, added if handedness differs
+
+        self.max_cost = max_cost
+        self.label_cost = label_cost
+
+        # counts
+        self.hands_matched = 0
+        self.hands_unmatched = 0
+
+    def match_hands(self, left_landmarks, left_handedness,
+                    right_landmarks, right_handedness):
+        # [(left hand id, right hand id), ...]
+        # landmarks: (hands, 21, 3) pixels, handedness: (hands, 2)
+
+        n_left = left_landmarks.shape[0]
+        n_right = right_landmarks.shape[0]
+        if n_left == 0 or n_right == 0:
+            self.hands_unmatched += n_left + n_right
+            return []
+
+        # (n_left, n_right) costs
+        cost = np.abs(left_landmarks[:, np.newaxis, :, 1] -
+                      right_landmarks[np.newaxis, :, :, 1]).mean(axis=2)
+        cost += self.label_cost * \
+            (left_handedness[:, np.newaxis, 0] !=
+             right_handedness[np.newaxis, :, 0])
+
+        if n_left <= n_right:
+            candidates = [list(zip(range(n_left), right_ids))
+                          for right_ids in
+                          itertools.permutations(range(n_right), n_left)]
+        else:
+            candidates = [list(zip(left_ids, range(n_right)))
+                          for left_ids in
+                          itertools.permutations(range(n_left), n_right)]
+
+        best = min(candidates,
+                   key=lambda pairs: sum(cost[i, j] for i, j in pairs))
+        pairs = [(i, j) for i, j in best if cost[i, j] <= self.max_cost]
+
+        self.hands_matched += len(pairs)
+        self.hands_unmatched += n_left + n_right - 2 * len(pairs)
+        return pairs
+
+    def match_fingertips(self, left_fingertips, right_fingertips, pairs):
+        # (M,4) left and (M,4) right [hand_id, tip_id, cx, cy] rows, same
+        # finger of the same hand in each row
+        left_rows = []
+        right_rows = []
+        for left_id, right_id in pairs:
+            left_hand = left_fingertips[left_fingertips[:, 0] == left_id]
+            right_hand = right_fingertips[right_fingertips[:, 0] == right_id]
+            # same tip_id order in both (HandDetector.fingerTips)
+            left_rows.append(left_hand)
+            right_rows.append(right_hand)
+
+        if not left_rows:
+            return np.zeros((0, 4)), np.zeros((0, 4))
+        return np.concatenate(left_rows), np.concatenate(right_rows)
@@ -10,8 +10,15 @@ hand.index y el primer campo del landmark (asumido como tip_id).
 @author: mherrera
 """
 
+import time
+import collections
 import mediapipe as mp
 import cv2
+import numpy as np
+
+# handedness of a detected hand, as the mediapipe classification (index 0
+# 'Left', 1 'Right')
+Handedness = collections.namedtuple('Handedness', ['index', 'score', 'label'])
 
 
 class HandDetector():
@@ -45,7 +52,10 @@ class HandDetector():
     # fingerTips = {THUMB_TIP, INDEX_TIP, MIDDLE_TIP, RING_TIP, SMALL_TIP}
 
     def __init__(self, staticImageMode=False, maxHands=2, detectionCon=0.5,
-                 trackCon=0.5, img_width=640, img_height=480):
+                 trackCon=0.5, img_width=640, img_height=480,
+                 inference=True):
+        # inference=False: no mediapipe graph, only the landmark layout and
+        # the drawing (e.g. to draw results detected in another process)
 
         self.mode = staticImageMode
         self.maxHands = maxHands
@@ -55,35 +65,257 @@ class HandDetector():
         self.img_height = img_height
 
         self.mpHands = mp.solutions.hands
-        self.hands = self.mpHands.Hands(
-            static_image_mode=self.mode,
-            max_num_hands=self.maxHands,
-            min_detection_confidence=self.detectionCon,
-            min_tracking_confidence=self.trackCon)
+        self.hands = None
+        if inference:
+            self.hands = self.mpHands.Hands(
+                static_image_mode=self.mode,
+                max_num_hands=self.maxHands,
+                min_detection_confidence=self.detectionCon,
+                min_tracking_confidence=self.trackCon)
         self.mpDraw = mp.solutions.drawing_utils
 
         self.results = []
 
+        # Region of interest (ROI) mode, see setRoi. roi is the region
+        # (x0, y0, x1, y1) of the last findHands; landmarks are normalized
+        # to it and mapped back to full frame pixels.
+        self.roi_base = None
+        self.roi_margin = 0
+        self.roi_scale = 1.0
+        self.roi_tracking = False
+        self.roi = (0, 0, img_width, img_height)
+        self.detected_roi = self.roi
+
         self.fingerTips = [self.mpHands.HandLandmark.THUMB_TIP,
                            self.mpHands.HandLandmark.INDEX_FINGER_TIP,
                            self.mpHands.HandLandmark.MIDDLE_FINGER_TIP,
                            self.mpHands.HandLandmark.RING_FINGER_TIP,
                            self.mpHands.HandLandmark.PINKY_TIP
                            ]
+        self.fingerTipsIndex = np.array(self.fingerTips, dtype=np.intp)
+        self.connections = [tuple(c) for c in self.mpHands.HAND_CONNECTIONS]
+
+        # findHands copies the landmarks here, once per frame:
+        # landmarks (x, y pixels, z) and handedness (1.0 right/0.0 left,
+        # score) of the first n_hands hands
+        self.n_hands = 0
+        self.landmarks = np.zeros((self.maxHands, 21, 3), dtype=np.float32)
+        self.handedness = np.zeros((self.maxHands, 2), dtype=np.float32)
+        self.fingertips = np.zeros((self.maxHands * len(self.fingerTips), 4))
+
+        # Frame skipping mode, see setFrameSkipping
+        self.skip_frames = False
+        self.skip_interval = 1
+        self.frames_since_inference = 0
+        self.frame_time = 0.0
+        self.frames_inferred = 0
+        self.frames_propagated = 0
+        self.gray = None
+        self.prevGray = None
+
+        # RGB input of mediapipe (see getRgbBuffer)
+        self.rgb = None
 
     def setImageDims(self, width, height):
         self.__image_width = width
         self.__image_height = height
 
+    def setRoi(self, x0, y0, x1, y1, margin=0, scale=1.0, tracking=False):
+        # Detect only in the region (x0, y0)-(x1, y1) plus margin pixels,
+        # downscaled by scale. With tracking the region follows the hands
+        # (same size or bigger) and goes back to the base region when they
+        # are lost. The region only moves when a hand gets within margin/2
+        # pixels of its edges (hysteresis): mediapipe tracks the hands from
+        # the previous frame, and a crop translated every frame disturbs it.
+        self.roi_margin = margin
+        self.roi_scale = scale
+        self.roi_tracking = tracking
+        self.roi_base = self.clampRoi(x0 - margin, y0 - margin,
+                                      x1 + margin, y1 + margin)
+        self.roi = self.roi_base
+
+    def clearRoi(self):
+        self.roi_base = None
+        self.roi_scale = 1.0
+        self.roi_tracking = False
+        self.roi = (0, 0, self.img_width, self.img_height)
+        self.detected_roi = self.roi
+
+    def clampRoi(self, x0, y0, x1, y1):
+        x0 = int(max(0, x0))
+        y0 = int(max(0, y0))
+        x1 = int(min(self.img_width, x1))
+        y1 = int(min(self.img_height, y1))
+        return x0, y0, x1, y1
+
+    def roiContains(self, roi, min_x, min_y, max_x, max_y):
+        # the hands box is inside roi, margin/2 pixels away from the edges
+        # that are not the frame border
+        border = self.roi_margin / 2
+        x0, y0, x1, y1 = roi
+        return (x0 == 0 or min_x >= x0 + border) and \
+            (y0 == 0 or min_y >= y0 + border) and \
+            (x1 == self.img_width or max_x <= x1 - border) and \
+            (y1 == self.img_height or max_y <= y1 - border)
+
+    def trackRoi(self):
+        # keep the region (the current one, else the base one) while the
+        # hands stay inside it, center it on them otherwise
+        hands = self.landmarks[:self.n_hands]
+        xs = hands[:, :, 0]
+        ys = hands[:, :, 1]
+        min_x, max_x = float(xs.min()), float(xs.max())
+        min_y, max_y = float(ys.min()), float(ys.max())
+
+        for roi in (self.roi, self.roi_base):
+            if self.roiContains(roi, min_x, min_y, max_x, max_y):
+                self.roi = roi
+                return
+
+        base_x0, base_y0, base_x1, base_y1 = self.roi_base
+        half_w = max(base_x1 - base_x0,
+                     max_x - min_x + 2 * self.roi_margin) / 2
+        half_h = max(base_y1 - base_y0,
+                     max_y - min_y + 2 * self.roi_margin) / 2
+        cx = (max_x + min_x) / 2
+        cy = (max_y + min_y) / 2
+
+        # keep the size when the region touches the frame border
+        cx = min(max(cx, half_w), self.img_width - half_w)
+        cy = min(max(cy, half_h), self.img_height - half_h)
+        self.roi = self.clampRoi(cx - half_w, cy - half_h,
+                                 cx + half_w, cy + half_h)
+
+    def setFrameSkipping(self, maxInterval=4, targetRate=30.0,
+                         minTracked=0.8, maxError=30.0, winSize=(15, 15)):
+        # Run mediapipe only every skip_interval frames and move the
+        # landmarks in between with sparse optical flow (pyramidal
+        # Lucas-Kanade on a winSize patch around each landmark). The
+        # interval adapts (1 to maxInterval) to keep targetRate frames per
+        # second. Mediapipe runs anyway when there are no hands, or when
+        # the flow tracks less than minTracked of the landmarks of a hand
+        # or with a mean error over maxError.
+        self.skip_frames = True
+        self.skip_max_interval = maxInterval
+        self.skip_target_period = 1.0 / targetRate
+        self.skip_min_tracked = minTracked
+        self.skip_max_error = maxError
+        self.lk_params = dict(
+            winSize=winSize, maxLevel=2,
+            criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT,
+                      10, 0.03))
+
+    def clearFrameSkipping(self):
+        self.skip_frames = False
+        self.skip_interval = 1
+        self.prevGray = None
+
+    def getFrameStats(self):
+        # frames with mediapipe inference and with propagated landmarks
+        return {'inferred': self.frames_inferred,
+                'propagated': self.frames_propagated,
+                'interval': self.skip_interval}
+
     def findHands(self, img):
 
+        if not self.skip_frames:
+            self.frames_inferred += 1
+            return self.inferHands(img)
+
+        start = time.perf_counter()
+
+        # gray frames (buffers reused) for the optical flow
+        if self.gray is None or self.gray.shape != img.shape[:2]:
+            self.gray = np.empty(img.shape[:2], dtype=np.uint8)
+            self.prevGray = None
+        cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=self.gray)
+
+        if self.n_hands > 0 and self.prevGray is not None and \
+                self.frames_since_inference < self.skip_interval and \
+                self.propagateHands():
+            found = True
+            self.frames_propagated += 1
+            self.frames_since_inference += 1
+            if self.roi_tracking:
+                self.trackRoi()
+        else:
+            found = self.inferHands(img)
+            self.frames_inferred += 1
+            self.frames_since_inference = 1
+            self.adaptInterval()
+
+        # the current gray frame is the previous one of the next frame
+        if self.prevGray is None:
+            self.prevGray = np.empty_like(self.gray)
+        self.gray, self.prevGray = self.prevGray, self.gray
+
+        # mean time per frame (exponential moving average)
+        self.frame_time += 0.1 * (time.perf_counter() - start -
+                                  self.frame_time)
+        return found
+
+    def adaptInterval(self):
+        # more skipped frames when the mean frame time is over the target
+        # period, fewer when there is room
+        if self.frame_time > self.skip_target_period:
+            self.skip_interval = min(self.skip_interval + 1,
+                                     self.skip_max_interval)
+        elif self.frame_time < 0.7 * self.skip_target_period:
+            self.skip_interval = max(self.skip_interval - 1, 1)
+
+    def propagateHands(self):
+        # move the landmarks from prevGray to gray, False if the flow is
+        # not reliable (mediapipe is needed)
+        hands = self.landmarks[:self.n_hands]
+        points = np.ascontiguousarray(hands[:, :, :2]).reshape(-1, 1, 2)
+        newPoints, status, err = cv2.calcOpticalFlowPyrLK(
+            self.prevGray, self.gray, points, None, **self.lk_params)
+
+        tracked = status.reshape(self.n_hands, 21) == 1
+        n_tracked = tracked.sum(axis=1)
+        if n_tracked.min() < self.skip_min_tracked * 21:
+            return False
+        if err.reshape(-1)[tracked.reshape(-1)].mean() > self.skip_max_error:
+            return False
+
+        # the lost landmarks follow the mean motion of their hand
+        motion = (newPoints - points).reshape(self.n_hands, 21, 2)
+        motion[~tracked] = 0.0
+        meanMotion = motion.sum(axis=1) / n_tracked[:, np.newaxis]
+        motion = np.where(tracked[:, :, np.newaxis], motion,
+                          meanMotion[:, np.newaxis, :])
+        hands[:, :, :2] += motion
+        return True
+
+    def getRgbBuffer(self, shape):
+        # mediapipe input buffer, reallocated only when the region size
+        # changes
+        if self.rgb is None or self.rgb.shape != shape:
+            self.rgb = np.empty(shape, dtype=np.uint8)
+        return self.rgb
+
+    def inferHands(self, img):
+
+        # crop (a view, no copy) and downscale to the region of interest,
+        # converted to RGB into a reused buffer
+        x0, y0, x1, y1 = self.roi
+        imgRoi = img[y0:y1, x0:x1]
+        if self.roi_scale != 1.0:
+            size = (int(round((x1 - x0) * self.roi_scale)),
+                    int(round((y1 - y0) * self.roi_scale)))
+            imgRGB = self.getRgbBuffer((size[1], size[0], 3))
+            cv2.resize(imgRoi, size, dst=imgRGB,
+                       interpolation=cv2.INTER_AREA)
+            cv2.cvtColor(imgRGB, cv2.COLOR_BGR2RGB, dst=imgRGB)
+        else:
+            imgRGB = self.getRgbBuffer(imgRoi.shape)
+            cv2.cvtColor(imgRoi, cv2.COLOR_BGR2RGB, dst=imgRGB)
+
         # To improve performance, optionally mark the image as not writeable to
         # pass by reference.
-        img.flags.writeable = False
-        imgRGB = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        img.flags.writeable = True
-
+        imgRGB.flags.writeable = False
         self.results = self.hands.process(imgRGB)
+        imgRGB.flags.writeable = True
 
         # print(results.multi_hand_landmark)
         found = False
@@ -92,18 +324,75 @@ class HandDetector():
             #     datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             #     self.results.multi_handedness))
             found = True
-        return found
 
-    def drawHands(self, img):
-        # if self.results.multi_handedness:
-        #     print('multi_handedness:\n{}'.format(
-        #         self.results.multi_handedness))
+        # the landmarks of this frame are normalized to self.roi
+        self.detected_roi = self.roi
+        self.extractLandmarks()
 
-        if self.results.multi_hand_landmarks:
-            for handLandmarks in self.results.multi_hand_landmarks:
-                self.mpDraw.draw_landmarks(
-                    img, handLandmarks, self.mpHands.HAND_CONNECTIONS)
-        # return imgRGB
+        # region for the next frame
+        if self.roi_tracking:
+            if found:
+                self.trackRoi()
+            else:
+                self.roi = self.roi_base
+        return found
+
+    def extractLandmarks(self):
+        # The only walk over the mediapipe landmarks: copy them to the
+        # landmarks array, in full frame pixels
+        self.n_hands = 0
+        if not self.results.multi_hand_landmarks:
+            return
+
+        for hand_id, handLandmarks in enumerate(
+                self.results.multi_hand_landmarks[:self.maxHands]):
+            self.landmarks[hand_id] = [(lm.x, lm.y, lm.z)
+                                       for lm in handLandmarks.landmark]
+            self.n_hands = hand_id + 1
+
+        for hand_id, handedness in enumerate(
+                self.results.multi_handedness[:self.n_hands]):
+            classification = handedness.classification[0]
+            self.handedness[hand_id, 0] = \
+                1.0 if classification.label == 'Right' else 0.0
+            self.handedness[hand_id, 1] = classification.score
+
+        x0, y0, x1, y1 = self.detected_roi
+        hands = self.landmarks[:self.n_hands]
+        hands[:, :, 0] *= x1 - x0
+        hands[:, :, 0] += x0
+        hands[:, :, 1] *= y1 - y0
+        hands[:, :, 1] += y0
+
+    def getLandmarks(self):
+        # (hands, 21, 3) view of the landmarks (x, y pixels, z), and the
+        # (hands, 2) handedness (1.0 right / 0.0 left, score); the arrays
+        # are reused by the next findHands
+        return self.landmarks[:self.n_hands], self.handedness[:self.n_hands]
+
+    def getFingerTipsArray(self):
+        # (hands*5, 4) view of [hand_id, tip_id, cx, cy] rows, reused by the
+        # next call
+        n_tips = self.n_hands * len(self.fingerTips)
+        tips = self.fingertips[:n_tips]
+        tips[:, 0] = np.repeat(np.arange(self.n_hands), len(self.fingerTips))
+        tips[:, 1] = np.tile(self.fingerTipsIndex, self.n_hands)
+        tips[:, 2:4] = self.landmarks[:self.n_hands][
+            :, self.fingerTipsIndex, :2].reshape(-1, 2)
+        return tips
+
+    def drawHands(self, img, landmarks=None):
+        # landmarks: a previous getLandmarks array (default: the last one)
+        if landmarks is None:
+            landmarks = self.landmarks[:self.n_hands]
+
+        # same look as mediapipe drawing_utils.draw_landmarks
+        for hand in landmarks[:, :, :2].astype(np.int32):
+            for start, end in self.connections:
+                cv2.line(img, tuple(hand[start]), tuple(hand[end]),
+                         (224, 224, 224), 2)
+            for point in hand:
+                cv2.circle(img, tuple(point), 2, (0, 0, 255), 2)
 
     # # TODO: No es necesario pasar la img, solo por w+h???
     # def getJoints(self, img, handNo=0, draw=False):
@@ -127,77 +416,28 @@ class HandDetector():
     #                 img, handLandmarks,
     #                 self.mpHands.HAND_CONNECTIONS)
 
-    def drawTips(self, img):
-        if self.results.multi_hand_landmarks:
-            for id, handLandmarks in enumerate(
-                    self.results.multi_hand_landmarks):
-                # print('handLandmarks=id:{}'.format(id))
-                for indx_tips in self.fingerTips:
-                    cx = handLandmarks.landmark[indx_tips].x * \
-                        self.img_width
-                    cy = handLandmarks.landmark[indx_tips].y * \
-                        self.img_height
-                    cv2.circle(img, (int(cx), int(cy)),
-                               7, (255, 0, 0), cv2.FILLED)
-
-                # self.mpHands.HandLandmark.INDEX_FINGER_TIP].x
-
-    # TODO: Obtener la referencia W y H una sola vez sin pasar la img
+    def drawTips(self, img, landmarks=None):
+        if landmarks is None:
+            landmarks = self.landmarks[:self.n_hands]
+
+        for cx, cy in landmarks[:, self.fingerTipsIndex, :2].reshape(-1, 2):
+            cv2.circle(img, (int(cx), int(cy)),
+                       7, (255, 0, 0), cv2.FILLED)
+
+    def getHandedness(self):
+        # from the handedness array, the same hands as the landmarks
+        return [Handedness(int(right), float(score),
+                           'Right' if right else 'Left')
+                for right, score in self.handedness[:self.n_hands]]
+
     def getFingerTipsPos(self):
-        fingertips = []
-        if self.results.multi_hand_landmarks:
-            for hand_id, handLandmarks in enumerate(
-                    self.results.multi_hand_landmarks):
-                # print('handLandmarks=id:{}'.format(id))
-                for indx_tips in self.fingerTips:
-                    tip_id = indx_tips
-                    cx = handLandmarks.landmark[indx_tips].x * \
-                        self.img_width
-                    cy = handLandmarks.landmark[indx_tips].y * \
-                        self.img_height
-                    fingertips.append([hand_id, tip_id, cx, cy])
-
-        hands = []
-        if self.results.multi_handedness:
-            for handedness in self.results.multi_handedness:
-                # print('handedness.classification:\nindex: {}\nscore: {}\nlabel: {}'.\
-                #       format(
-                #           handedness.classification[0].index,
-                #           handedness.classification[0].score,
-                #           handedness.classification[0].label
-                #     )
-                # )
-                hands.append(handedness.classification[0])
-
-        return [hands, fingertips]
-
-    # TODO: Obtener la referencia W y H una sola vez sin pasar la img
+        fingertips = [[int(hand_id), int(tip_id), float(cx), float(cy)]
+                      for hand_id, tip_id, cx, cy
+                      in self.getFingerTipsArray()]
+        return [self.getHandedness(), fingertips]
+
     def getIndexFingerTipPos(self):
-        indexTips = []
-        if self.results.multi_hand_landmarks:
-            for handLandmarks in self.results.multi_hand_landmarks:
-                x = handLandmarks.landmark[
-                    self.mpHands.HandLandmark.INDEX_FINGER_TIP].x * \
-                    self.img_width
-                y = handLandmarks.landmark[
-                    self.mpHands.HandLandmark.INDEX_FINGER_TIP].y * \
-                    self.img_height
-                z = handLandmarks.landmark[
-                    self.mpHands.HandLandmark.INDEX_FINGER_TIP].z * \
-                    1  # self.img_width
-
-                indexTips.append((x, y, z))
-
-        hands = []
-        if self.results.multi_handedness:
-            for handedness in self.results.multi_handedness:
-                # print('handedness.classification:\nindex: {}\nscore: {}\nlabel: {}'.\
-                #       format(
-                #           handedness.classification[0].index,
-                #           handedness.classification[0].score,
-                #           handedness.classification[0].label
-                #     )
-                # )
-                hands.append(handedness.classification[0])
-
-        return hands, indexTips
+        index_tip = self.mpHands.HandLandmark.INDEX_FINGER_TIP
+        indexTips = [tuple(float(v) for v in tip)
+                     for tip in self.landmarks[:self.n_hands, index_tip]]
+        return self.getHandedness(), indexTips
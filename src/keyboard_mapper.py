@@ -7,10 +7,19 @@ Created on Mon Aug 30 00:43:58 2021
 """
 import numpy as np
 
+NO_KEYS = np.zeros(0, dtype=np.intp)
+NO_KEYS.flags.writeable = False
+
 
 class KeyboardMap:
-    def __init__(self):
-        self.prev_map = np.empty(0, dtype=bool)
+    def __init__(self, default_velocity=127*2//3):
+        # sorted indices of the pressed keys (a handful at most)
+        self.active_keys = NO_KEYS
+
+        # note on velocity of each key in on_keys (default_velocity without
+        # fingers_velocity)
+        self.on_velocity = NO_KEYS
+        self.default_velocity = default_velocity
 
     def get_kayboard_map(self,
                          virtual_keyboard,
@@ -19,50 +28,81 @@ class KeyboardMap:
                          center_point_distance,
                          keyboard_n_key):
 
-        curr_map = np.full((keyboard_n_key, 1), False, dtype=bool)
+        # fingertips_pos: [hand_id, tip_id, x, y] per fingertip
+        fingertips_xy = np.array(
+            [(fingertip_pos[2], fingertip_pos[3])
+             for fingertip_pos in fingertips_pos],
+            dtype=np.float64).reshape(-1, 2)
+
+        on_keys, off_keys = self.get_key_changes(
+            virtual_keyboard=virtual_keyboard,
+            fingertips_xy=fingertips_xy,
+            fingers_height=fingers_height,
+            center_point_distance=center_point_distance,
+            keyboard_n_key=keyboard_n_key)
+
+        # full keyboard (keyboard_n_key, 1) on/off maps
         on_map = np.full((keyboard_n_key, 1), False, dtype=bool)
         off_map = np.full((keyboard_n_key, 1), False, dtype=bool)
-        # obtain the current map pressed piano keys
-        for fingertip_pos, dist in zip(fingertips_pos, fingers_height):
-            # print('fpos: Hand:{} tip:{} x:{} y:{}'.format(
-            #     fingertip_pos[0],
-            #     fingertip_pos[1],
-            #     fingertip_pos[2],
-            #     fingertip_pos[3]))
-
-            if virtual_keyboard.intersect((fingertip_pos[2],
-                                           fingertip_pos[3])):
-                # Aquí deberia hacer un mapa de las teclas presionadas
-                key = virtual_keyboard.find_key(fingertip_pos[2],
-                                                fingertip_pos[3])
-                # print('keyboard_piano:key:{}'.format(key))
-                if key >= 0 and key < keyboard_n_key:
-                    try:
-                        # TODO: devería evaluar para todos los dedos
-                        if dist > center_point_distance:
-                            curr_map[key] = True
-                    except Exception:
-                        print('key:{}'.format(key))
-                        raise
-
-        if np.all((curr_map == False)) and \
-            np.all((self.prev_map == False)):
-            # print('all zero')
-            None
-        else:
-            # print('Current Map:{}'.format(np_curr_map))
-            # print('Previ   Map:{}'.format(np_prev_map))
+        on_map[on_keys, 0] = True
+        off_map[off_keys, 0] = True
+        return on_map, off_map
 
-            xor_map = np.bitwise_xor(self.prev_map, curr_map)
-            # print('--- XOR Map:{}'.format(xor_map))
-            # xnor_map = np.bitwise_not(xor_map)
-            # print('--- XNOR Map:{}'.format(xnor_map))
+    def get_key_changes(self,
+                        virtual_keyboard,
+                        fingertips_xy,
+                        fingers_height,
+                        center_point_distance,
+                        keyboard_n_key,
+                        fingers_velocity=None):
+        # fingertips_xy: (N,2) array of fingertip pixel positions
+        # fingers_height: (N,) array of fingertip distances
+        # fingers_velocity: (N,) note on velocities, on_velocity gets the
+        # highest one of the fingers pressing each new key
+        # returns the (sorted) indices of the keys pressed and released
+        # since the previous call
 
-            on_map = np.logical_and(xor_map, curr_map)
-            off_map = np.logical_and(xor_map, self.prev_map)
+        fingertips_xy = np.asarray(fingertips_xy).reshape(-1, 2)
+        if fingertips_xy.shape[0] == 0:
+            if self.active_keys.size == 0:
+                # print('all zero')
+                return NO_KEYS, NO_KEYS
+            off_keys = self.active_keys
+            self.active_keys = NO_KEYS
+            self.on_velocity = NO_KEYS
+            return NO_KEYS, off_keys
 
-            # print('on      Map:{}'.format(on_map))
-            # print('off     Map:{}\n'.format(off_map))
+        # obtain the current pressed piano keys
+        keys = virtual_keyboard.find_keys(fingertips_xy)
+        fingers_height = np.asarray(fingers_height,
+                                    dtype=np.float64).reshape(-1)
+        pressing = (keys >= 0) & (keys < keyboard_n_key) & \
+            (fingers_height > center_point_distance)
+        pressed = keys[pressing]
 
-            self.prev_map = curr_map
-        return on_map, off_map
+        if pressed.size == 0 and self.active_keys.size == 0:
+            return NO_KEYS, NO_KEYS
+
+        curr_keys = np.unique(pressed)
+        on_keys = np.setdiff1d(curr_keys, self.active_keys,
+                               assume_unique=True)
+        off_keys = np.setdiff1d(self.active_keys, curr_keys,
+                                assume_unique=True)
+
+        if fingers_velocity is not None and on_keys.size > 0:
+            # highest velocity per new key
+            velocity = np.asarray(fingers_velocity).reshape(-1)[pressing]
+            new = np.isin(pressed, on_keys)
+            self.on_velocity = np.zeros(on_keys.size, dtype=np.int64)
+            np.maximum.at(self.on_velocity,
+                          np.searchsorted(on_keys, pressed[new]),
+                          velocity[new])
+        else:
+            self.on_velocity = np.full(on_keys.size, self.default_velocity,
+                                       dtype=np.int64)
+
+        # print('on      keys:{}'.format(on_keys))
+        # print('off     keys:{}\n'.format(off_keys))
+
+        self.active_keys = curr_keys
+        return on_keys, off_keys
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 15:02:44 2026
+
+Temporal filter bank for the fingertip tracks (TODO1: stabilize the finger
+positions).
+
+One One-Euro filter per track and value, all updated in one NumPy pass: a
+low pass filter whose cutoff frequency grows with the speed, so slow
+movements are smoothed (jitter) and fast ones are followed without lag. The
+filtered derivative also gives a constant velocity prediction, used to look
+one frame ahead and cover the camera-to-sound latency.
+
+    Géry Casiez, Nicolas Roussel, Daniel Vogel
+    1€ Filter: A Simple Speed-based Low-pass Filter for Noisy Input in
+    Interactive Systems
+    https://gery.casiez.net/1euro/
+
+@author: mherrera
+"""
+import math
+import numpy as np
+
+
+class OneEuroFilterBank:
+
+    def __init__(self,
+                 n_tracks,
+                 n_values,
+                 min_cutoff=1.0,    # Hz, smoothing at low speed
+                 beta=0.05,         # cutoff increase per unit/s of speed
+                 d_cutoff=1.0,      # Hz, for the derivative
+                 max_gap=0.25,      # seconds, older tracks start over
+                 positive=()):      # value columns that must be > 0
+                                    # (e.g. depth)
+
+        self.min_cutoff = min_cutoff
+        self.positive = list(positive)
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.max_gap = max_gap
+
+        # state per track
+        self.value = np.zeros((n_tracks, n_values))
+        self.derivative = np.zeros((n_tracks, n_values))
+        self.timestamp = np.full(n_tracks, -np.inf)
+
+    @staticmethod
+    def alpha(cutoff, dt):
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def update(self, track_ids, values, timestamp):
+        # track_ids: (M,) distinct track ids, values: (M, n_values)
+        # returns the (M, n_values) filtered values
+        # invalid rows (not finite, or not > 0 in a positive column, e.g.
+        # triangulation with zero disparity) do not touch the track: the
+        # last estimate is returned (NaN if the track has none)
+
+        track_ids = np.asarray(track_ids, dtype=np.intp)
+        values = np.asarray(values, dtype=np.float64)
+
+        valid = np.isfinite(values).all(axis=1)
+        if self.positive:
+            valid &= (values[:, self.positive] > 0).all(axis=1)
+        if not valid.all():
+            filtered = np.full(values.shape, np.nan)
+            held = track_ids[~valid]
+            live = timestamp - self.timestamp[held] <= self.max_gap
+            filtered[np.flatnonzero(~valid)[live]] = self.value[held[live]]
+            if valid.any():
+                filtered[valid] = self.update(track_ids[valid],
+                                              values[valid], timestamp)
+            return filtered
+
+        dt = timestamp - self.timestamp[track_ids]
+        new = ~(dt <= self.max_gap)   # also not seen yet (inf)
+        dt = np.where(new | (dt <= 0), 1.0, dt)[:, np.newaxis]
+
+        prev_value = self.value[track_ids]
+        prev_derivative = self.derivative[track_ids]
+
+        # filtered derivative
+        a_d = self.alpha(self.d_cutoff, dt)
+        derivative = a_d * (values - prev_value) / dt + \
+            (1 - a_d) * prev_derivative
+
+        # speed dependent cutoff
+        cutoff = self.min_cutoff + self.beta * np.abs(derivative)
+        a = self.alpha(cutoff, dt)
+        filtered = a * values + (1 - a) * prev_value
+
+        # new tracks start at the measure, without speed
+        filtered[new] = values[new]
+        derivative[new] = 0.0
+
+        self.value[track_ids] = filtered
+        self.derivative[track_ids] = derivative
+        self.timestamp[track_ids] = timestamp
+        return filtered
+
+    def predict(self, track_ids, horizon):
+        # (M, n_values) values horizon seconds after the last update
+        track_ids = np.asarray(track_ids, dtype=np.intp)
+        return self.value[track_ids] + self.derivative[track_ids] * horizon
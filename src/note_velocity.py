@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 16:20:37 2026
+
+Note on velocity from the speed of the fingertips towards the keyboard.
+
+Every fingertip track keeps its last `history` distances (D, cms) with their
+capture timestamps in a fixed (tracks, history) ring, and the speed is the
+least squares slope of those samples, for all the tracks at once. A
+calibration curve (piecewise linear, speeds in cms/s -> MIDI velocity) turns
+the speed into the velocity: a slow press plays soft, a fast one loud.
+Tracks without a speed yet (a single sample, e.g. a hand that just entered)
+play default_velocity. Non-finite distances are not added to the history.
+
+@author: mherrera
+"""
+import numpy as np
+
+
+class VelocityEstimator:
+
+    def __init__(self,
+                 n_tracks,
+                 history=4,                 # samples per track
+                 speeds=(0, 15, 40, 80),    # cms/s, calibration curve x
+                 velocities=(30, 70, 110, 127),  # MIDI, calibration curve y
+                 max_gap=0.25,              # seconds, older tracks start over
+                 default_velocity=64):      # MIDI, tracks without speed
+
+        self.history = history
+        self.default_velocity = default_velocity
+        self.speeds = np.asarray(speeds, dtype=np.float64)
+        self.velocities = np.asarray(velocities, dtype=np.float64)
+        self.max_gap = max_gap
+
+        # ring of samples per track
+        self.values = np.zeros((n_tracks, history))
+        self.times = np.full((n_tracks, history), -np.inf)
+        self.count = np.zeros(n_tracks, dtype=np.intp)
+        self.last_time = np.full(n_tracks, -np.inf)
+
+        # last speed and velocity of every track
+        self.speed = np.zeros(n_tracks)
+        self.velocity = np.zeros(n_tracks, dtype=np.int64)
+
+    def update(self, track_ids, distances, timestamp):
+        # track_ids: (M,) distinct track ids, distances: (M,) D in cms
+        # returns the (M,) MIDI velocities
+
+        track_ids = np.asarray(track_ids, dtype=np.intp)
+        distances = np.asarray(distances, dtype=np.float64).reshape(-1)
+
+        # tracks lost for a while start an empty history
+        lost = track_ids[~(timestamp - self.last_time[track_ids] <=
+                           self.max_gap)]
+        self.times[lost] = -np.inf
+        self.count[lost] = 0
+
+        # only the finite distances are new samples
+        finite = np.isfinite(distances)
+        sampled = track_ids[finite]
+        slot = self.count[sampled] % self.history
+        self.values[sampled, slot] = distances[finite]
+        self.times[sampled, slot] = timestamp
+        self.count[sampled] += 1
+        self.last_time[sampled] = timestamp
+
+        # least squares slope of the valid samples of each track
+        times = self.times[track_ids]
+        values = self.values[track_ids]
+        valid = np.isfinite(times)
+        n = np.maximum(valid.sum(axis=1), 1)
+        times = np.where(valid, times - timestamp, 0.0)
+        values = np.where(valid, values, 0.0)
+        mean_t = times.sum(axis=1) / n
+        mean_v = values.sum(axis=1) / n
+        dt = np.where(valid, times - mean_t[:, np.newaxis], 0.0)
+        dv = np.where(valid, values - mean_v[:, np.newaxis], 0.0)
+        var_t = (dt * dt).sum(axis=1)
+        speed = np.divide((dt * dv).sum(axis=1), var_t,
+                          out=np.zeros(len(track_ids)), where=var_t > 0)
+
+        # towards the keyboard only (D grows), through the curve; tracks
+        # with less than two samples have no speed
+        speed = np.maximum(np.nan_to_num(speed), 0.0)
+        velocity = np.interp(speed, self.speeds, self.velocities)
+        velocity = np.where(var_t > 0, velocity, self.default_velocity)
+        velocity = np.clip(np.rint(np.nan_to_num(velocity)), 1,
+                           127).astype(np.int64)
+
+        self.speed[track_ids] = speed
+        self.velocity[track_ids] = velocity
+        return velocity
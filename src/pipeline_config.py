@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 20:04:17 2026
+
+Run configuration of the virtual piano keyboard.
+
+The defaults are the values main() used to hardcode (cameras 2 and 0 at
+640x480, Logi C920 field of view, 14.21 cm between cameras, keyboard 71 cm
+away, 3 banks, FluidR3 on ALSA, ...). A profile file (JSON, or TOML with
+Python 3.11+) only needs the values it changes, e.g.
+
+    {"cameras": {"width": 1280, "height": 720, "frame_rate": 60},
+     "detection": {"multiprocess": true, "scale": 0.5}}
+
+and the command line goes last:
+
+    python src/virtualpianokb.py --config bench.json --set keyboard.n_bank=2
+
+Unknown sections or keys are errors (a typo would be silently ignored
+otherwise). resolve() fills in the values that depend on others (replay
+buffering, pipelined detection), so the config logged with the run summary
+is the one actually used.
+
+@author: mherrera
+"""
+import copy
+import json
+
+# ------------------------------
+# Defaults
+# ------------------------------
+
+DEFAULTS = {
+    'cameras': {
+        'left': 2,                  # device, video file or image sequence
+        'right': 0,
+        'width': 640,
+        'height': 480,
+        'frame_rate': 30,
+        # Logi C920s HD Pro Webcam
+        'h_fov': 70.42,             # Horizontal Field of View
+        'v_fov': 43.3,              # Vertical Field of View
+        'h_fov_rectification': 21.42,
+        'separation': 14.21,        # cms
+        'in_front_of_you': True,
+        'buffer_all': None,         # None: only replays (lossless)
+        'try_to_reconnect': False,
+    },
+    'keyboard': {
+        'n_bank': 3,                # octaves
+        'center_point_distance': 71,    # cms, to the cameras
+        'octave_base': 0,
+    },
+    'synth': {
+        'soundfont': '/usr/share/sounds/sf2/FluidR3_GM.sf2',
+        'driver': 'alsa',
+        'bank': 0,                  # 000-000 Yamaha Grand Piano
+        'preset': 0,
+    },
+    'detection': {
+        'multiprocess': False,      # a process per camera
+        'pipelined': None,          # None: processes or cameras (not
+                                    # replays in threads)
+        'process_slots': 12,        # shared memory ring of each process
+        'detection_con': 0.75,
+        'track_con': 0.5,
+        'roi': True,                # only around the keyboard
+        'roi_margin': 96,
+        'scale': 1.0,               # detection resolution (ROI scale)
+        'frame_skipping': False,    # optical flow between inferences
+                                    # (opt-in, changes the landmarks)
+        'max_interval': 4,
+        'rectification': 'off',     # with the stereo calibration:
+                                    # 'off', 'landmarks' or 'frames'
+    },
+    'display': {
+        'headless': False,          # no window nor audio device
+        'max_fps': 30,
+    },
+    'profile': {
+        'enabled': True,
+        'file': None,               # .json or .csv
+    },
+}
+
+
+RECTIFICATION = ('off', 'landmarks', 'frames')
+
+# octaves of the keyboard, from MIDI note 36 (up to 120 + its black key)
+N_BANK_RANGE = (1, 7)
+
+
+def default_config():
+    return copy.deepcopy(DEFAULTS)
+
+
+def merge(config, overrides, section=None):
+    # overrides (same nesting) into config, ValueError on unknown keys
+    for key, value in overrides.items():
+        name = key if section is None else section + '.' + key
+        if key not in config:
+            raise ValueError('unknown config key: {}'.format(name))
+        if isinstance(config[key], dict):
+            if not isinstance(value, dict):
+                raise ValueError('config section expected: {}'.format(name))
+            merge(config[key], value, name)
+        else:
+            config[key] = value
+    return config
+
+
+def load(file_name, config=None):
+    # profile file (.json or .toml) over config (the defaults if None)
+    if config is None:
+        config = default_config()
+    if file_name.lower().endswith('.toml'):
+        import tomllib  # Python 3.11+
+        with open(file_name, 'rb') as toml_file:
+            overrides = tomllib.load(toml_file)
+    else:
+        with open(file_name) as json_file:
+            overrides = json.load(json_file)
+    return merge(config, overrides)
+
+
+def parse_value(text):
+    # JSON values (numbers, true/false, null), anything else is a string
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def set_value(config, assignment):
+    # 'section.key=value'
+    name, separator, text = assignment.partition('=')
+    if not separator or '.' not in name:
+        raise ValueError('expected section.key=value: {}'.format(assignment))
+    section, key = name.strip().split('.', 1)
+    return merge(config, {section: {key: parse_value(text.strip())}})
+
+
+def resolve(config):
+    # fill in the values that depend on others
+    for side in ('left', 'right'):
+        source = config['cameras'][side]
+        if isinstance(source, str) and source.isdigit():
+            config['cameras'][side] = int(source)
+    replay = not isinstance(config['cameras']['left'], int)
+    config['replay'] = replay
+    if config['cameras']['buffer_all'] is None:
+        config['cameras']['buffer_all'] = replay
+    for key in ('width', 'height'):
+        value = config['cameras'][key]
+        if not isinstance(value, int) or isinstance(value, bool) or \
+                value <= 0:
+            raise ValueError('cameras.{} must be a positive integer: '
+                             '{}'.format(key, value))
+    n_bank = config['keyboard']['n_bank']
+    if not isinstance(n_bank, int) or isinstance(n_bank, bool) or \
+            not N_BANK_RANGE[0] <= n_bank <= N_BANK_RANGE[1]:
+        raise ValueError('keyboard.n_bank must be an integer from {} to {}: '
+                         '{}'.format(N_BANK_RANGE[0], N_BANK_RANGE[1], n_bank))
+    if config['detection']['rectification'] not in RECTIFICATION:
+        raise ValueError('detection.rectification must be one of {}'.format(
+            ', '.join(RECTIFICATION)))
+    if config['detection']['pipelined'] is None:
+        config['detection']['pipelined'] = \
+            config['detection']['multiprocess'] or not replay
+    return config
+
+# ------------------------------
+# Command line
+# ------------------------------
+
+
+def video_source(value):
+    # camera device number, or video file / image sequence
+    return int(value) if value.isdigit() else value
+
+
+def add_arguments(parser):
+    parser.add_argument('--config',
+                        help='profile file (.json or .toml) over the '
+                             'defaults')
+    parser.add_argument('--set', action='append', default=[],
+                        metavar='SECTION.KEY=VALUE',
+                        help='override a config value (repeatable), e.g. '
+                             'cameras.width=1280')
+    parser.add_argument('--left', type=video_source,
+                        help='left camera device, video file or image '
+                             'sequence (e.g. img-%%04d.png)')
+    parser.add_argument('--right', type=video_source,
+                        help='right camera device, video file or image '
+                             'sequence')
+    parser.add_argument('--headless', action='store_true', default=None,
+                        help='no window nor audio device (null synth)')
+    parser.add_argument('--multiprocess', action='store_true', default=None,
+                        help='capture and detect each camera in its own '
+                             'process')
+    parser.add_argument('--profile-file',
+                        help='save the stage profile (.json or .csv)')
+    parser.add_argument('--print-config', action='store_true',
+                        help='print the resolved config and exit')
+    return parser
+
+
+def from_args(args):
+    # defaults < --config file < --set values < shortcut options
+    config = default_config()
+    if args.config:
+        load(args.config, config)
+    for assignment in args.set:
+        set_value(config, assignment)
+    shortcuts = {'cameras': {'left': args.left, 'right': args.right},
+                 'display': {'headless': args.headless},
+                 'detection': {'multiprocess': args.multiprocess},
+                 'profile': {'file': args.profile_file}}
+    for section, values in shortcuts.items():
+        merge(config, {section: {key: value for key, value in values.items()
+                                 if value is not None}})
+    return resolve(config)
+
+
+def dumps(config):
+    # one line, for the logs
+    return json.dumps(config, sort_keys=True)
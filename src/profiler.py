@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 17:05:12 2026
+
+Per stage latency profiler.
+
+Each stage (capture, detection, triangulation, key mapping, synth, display,
+...) records its durations, measured with time.perf_counter, in a fixed size
+ring per stage, so the p50/p95/p99 of the last `length` samples can be
+computed at any time without the history growing.
+
+    profiler = StageProfiler()
+    with profiler.span('detection'):
+        ...
+    t0 = profiler.clock()
+    ...
+    profiler.record('flip', t0)
+
+Disabled, span returns a shared do nothing context, and clock and record do
+nothing, so the spans can stay in the code.
+
+The summary goes to the dashboard (overlay_lines) or to a CSV or JSON file
+(with a CSV, the run data, config, counts, ..., go to a .meta.json sidecar).
+
+@author: mherrera
+"""
+import os
+import csv
+import json
+import time
+import contextlib
+import numpy as np
+
+NULL_SPAN = contextlib.nullcontext()
+
+
+class StageSpan:
+
+    __slots__ = ('profiler', 'stage', 'start')
+
+    def __init__(self, profiler, stage):
+        self.profiler = profiler
+        self.stage = stage
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.stage, self.start)
+        return False
+
+
+class StageProfiler:
+
+    def __init__(self, enabled=True, length=1000):
+
+        self.enabled = enabled
+        self.length = length
+
+        # stage -> [ring of durations (seconds), samples recorded]
+        # stages are created by the thread that records them first
+        self.stages = {}
+
+    def clock(self):
+        if not self.enabled:
+            return 0.0
+        return time.perf_counter()
+
+    def record(self, stage, start, end=None):
+        # duration from start (clock()) to end (now by default)
+        if not self.enabled:
+            return
+        if end is None:
+            end = time.perf_counter()
+        ring = self.stages.get(stage)
+        if ring is None:
+            ring = self.stages.setdefault(
+                stage, [np.zeros(self.length), 0])
+        ring[0][ring[1] % self.length] = end - start
+        ring[1] += 1
+
+    def merge(self, stages):
+        # stages recorded by another profiler (e.g. its .stages, sent back
+        # by a detection process), replacing the ones with the same name
+        if not self.enabled:
+            return
+        for stage, (ring, count) in stages.items():
+            self.stages[stage] = [np.array(ring, dtype=np.float64), count]
+
+    def span(self, stage):
+        if not self.enabled:
+            return NULL_SPAN
+        return StageSpan(self, stage)
+
+    def stats(self):
+        # stage -> count, mean, p50, p95, p99 and max, in milliseconds
+        stats = {}
+        for stage, (ring, count) in list(self.stages.items()):
+            if count == 0:
+                continue
+            values = ring[:min(count, self.length)] * 1000
+            p50, p95, p99 = np.percentile(values, (50, 95, 99))
+            stats[stage] = {'count': count,
+                            'mean_ms': float(values.mean()),
+                            'p50_ms': float(p50),
+                            'p95_ms': float(p95),
+                            'p99_ms': float(p99),
+                            'max_ms': float(values.max())}
+        return stats
+
+    def overlay_lines(self):
+        # one 'stage: p50/p95 ms' text line per stage, for the dashboard
+        return ['{}:{:.2f}/{:.2f}ms'.format(stage, s['p50_ms'], s['p95_ms'])
+                for stage, s in self.stats().items()]
+
+    def dump_csv(self, file_name, **extra):
+        # extra: saved next to the table, in <file name>.meta.json
+        fields = ['stage', 'count', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms',
+                  'max_ms']
+        with open(file_name, 'w', newline='') as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=fields)
+            writer.writeheader()
+            for stage, s in self.stats().items():
+                writer.writerow(dict(s, stage=stage))
+        if not extra:
+            return [file_name]
+        meta_file_name = os.path.splitext(file_name)[0] + '.meta.json'
+        with open(meta_file_name, 'w') as json_file:
+            json.dump(extra, json_file, indent=2)
+        return [file_name, meta_file_name]
+
+    def dump_json(self, file_name, **extra):
+        # extra: other data saved with the stats (config, counts, ...)
+        with open(file_name, 'w') as json_file:
+            json.dump(dict(extra, stages=self.stats()), json_file, indent=2)
+        return [file_name]
+
+    def dump(self, file_name, **extra):
+        # by extension, .csv or .json, returns the files written
+        if file_name.lower().endswith('.csv'):
+            return self.dump_csv(file_name, **extra)
+        return self.dump_json(file_name, **extra)
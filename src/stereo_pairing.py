@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 12:20:05 2026
+
+Stereo frame pairing by capture timestamp.
+
+Both cameras run free, so the left and right frames returned at the same
+time may come from different instants. StereoPairing pulls timestamped items
+from a left and a right source and only returns pairs captured within
+max_skew seconds of each other. Both sides are read without waiting while
+one of them is pending, so a few results of each camera are buffered and
+every item is paired with the nearest buffered item of the other side, not
+only with the newest one. Items older than the returned pair, and items that
+can no longer match (the other side is already past them), are dropped and
+counted (skew_stats).
+
+A source is any function source(wait) -> (finished, timestamp, item), like
+VideoThread.next_with_timestamp or DetectionThread.next_with_timestamp.
+
+@author: mherrera
+"""
+import time
+import collections
+import numpy as np
+
+
+class StereoPairing:
+
+    def __init__(self,
+                 left_source,
+                 right_source,
+                 max_skew=1/60,     # seconds
+                 max_pending=4,     # items kept per side while unmatched
+                 stats_length=300):
+
+        self.left_source = left_source
+        self.right_source = right_source
+        self.max_skew = max_skew
+
+        self.max_pending = max_pending
+        self.left_pending = collections.deque()
+        self.right_pending = collections.deque()
+
+        # counts and skew distribution (seconds, left - right)
+        self.pairs_returned = 0
+        self.left_dropped = 0
+        self.right_dropped = 0
+        self.skews = collections.deque(maxlen=stats_length)
+
+        self.finished = False
+
+    def pull(self, source, pending, wait):
+        finished, timestamp, item = source(wait)
+        if item is not None and timestamp is not None:
+            if len(pending) >= self.max_pending:
+                # oldest unmatched item out
+                pending.popleft()
+                if pending is self.left_pending:
+                    self.left_dropped += 1
+                else:
+                    self.right_dropped += 1
+            pending.append((timestamp, item))
+        return finished
+
+    def match(self):
+        # nearest left/right pair of the buffered items, dropping the stale
+        # ones
+        left = self.left_pending
+        right = self.right_pending
+        while left and right:
+            left_ts = np.array([timestamp for timestamp, _ in left])
+            right_ts = np.array([timestamp for timestamp, _ in right])
+            skews = np.abs(left_ts[:, None] - right_ts[None, :])
+            i, j = np.unravel_index(np.argmin(skews), skews.shape)
+            if skews[i, j] <= self.max_skew:
+                # the items before the pair are older than it
+                for _ in range(i):
+                    left.popleft()
+                for _ in range(j):
+                    right.popleft()
+                self.left_dropped += int(i)
+                self.right_dropped += int(j)
+                left_ts, left_item = left.popleft()
+                right_ts, right_item = right.popleft()
+                self.pairs_returned += 1
+                self.skews.append(left_ts - right_ts)
+                return left_ts, right_ts, left_item, right_item
+            # no match: the oldest item is stale, the other side (in capture
+            # order) is already more than max_skew past it
+            if left[0][0] < right[0][0]:
+                left.popleft()
+                self.left_dropped += 1
+            else:
+                right.popleft()
+                self.right_dropped += 1
+        return None
+
+    def next(self, wait=0):
+        # (finished, pair) where pair is (left_ts, right_ts, left, right),
+        # None if no matching pair arrives in wait seconds
+
+        deadline = time.monotonic() + wait
+        while True:
+            pair = self.match()
+            if pair is not None:
+                return False, pair
+
+            remaining = max(0.0, deadline - time.monotonic())
+
+            # wait for the side that is missing, and take what the other
+            # one already has (the nearest item may be newer)
+            finished = False
+            for source, pending, other in (
+                    (self.left_source, self.left_pending,
+                     self.right_pending),
+                    (self.right_source, self.right_pending,
+                     self.left_pending)):
+                if not pending:
+                    finished |= self.pull(source, pending, remaining)
+                elif len(pending) < self.max_pending - 1 and not other:
+                    finished |= self.pull(source, pending, 0)
+
+            if finished:
+                self.finished = True
+                return True, self.match()
+
+            if remaining <= 0:
+                return False, self.match()
+
+    def skew_stats(self):
+        # skew distribution, in milliseconds
+        # pairs returned and items dropped (never paired) per side
+        stats = {'pairs': self.pairs_returned,
+                 'left_dropped': self.left_dropped,
+                 'right_dropped': self.right_dropped}
+        if self.skews:
+            skews = np.abs(np.array(self.skews)) * 1000
+            stats['mean_ms'] = float(skews.mean())
+            stats['p50_ms'], stats['p95_ms'], stats['max_ms'] = \
+                (float(v) for v in np.percentile(skews, (50, 95, 100)))
+        return stats
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 15:48:20 2026
+
+Synth output thread: plays the note on/off events of the vision loop.
+
+The main loop only pushes (timestamp, key, velocity, on/off) events, it never
+calls the synth, so a slow frame (detection, imshow, waitKey) does not delay
+the sound of the events already decided. The queue is a collections.deque
+(append and popleft are atomic, no lock) plus an Event to wake the thread.
+
+Every event keeps two latencies:
+    queue:  push -> synth call (scheduling delay)
+    total:  event timestamp (frame capture) -> synth call
+the total one only with time.monotonic() timestamps (not in replays, where
+the frames are stamped with their media time).
+
+@author: mherrera
+"""
+import time
+import threading
+import collections
+import numpy as np
+
+# ------------------------------
+# Synth Event
+# ------------------------------
+
+SynthEvent = collections.namedtuple(
+    'SynthEvent',
+    ['timestamp',    # time.monotonic() of the frame that made the event
+     'key',          # MIDI note
+     'velocity',     # 0..127, 0 on note off
+     'on',           # True note on, False note off
+     'pushed'])      # time.monotonic() when queued
+
+# ------------------------------
+# Null Synth
+# ------------------------------
+
+
+class NullSynth:
+
+    # Synth without audio device (headless replays, benchmarks): keeps the
+    # played notes, and prints them if verbose
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.notes = []     # (time.monotonic(), chan, key, velocity, on)
+
+    def start(self, driver=None):
+        pass
+
+    def sfload(self, file_name):
+        return 1
+
+    def program_select(self, chan, sfid, bank, preset):
+        pass
+
+    def noteon(self, chan, key, vel):
+        self.notes.append((time.monotonic(), chan, key, vel, True))
+        if self.verbose:
+            print('synth:noteon:{}:{}'.format(key, vel))
+
+    def noteoff(self, chan, key):
+        self.notes.append((time.monotonic(), chan, key, 0, False))
+        if self.verbose:
+            print('synth:noteoff:{}'.format(key))
+
+    def delete(self):
+        pass
+
+# ------------------------------
+# Synth Scheduler
+# ------------------------------
+
+
+class SynthScheduler:
+
+    def __init__(self,
+                 synth,             # fluidsynth.Synth or alike
+                 chan=0,
+                 idle_wait=0.1,     # seconds, to check the run state
+                 stats_length=1000,
+                 total_latency=True):   # timestamps are time.monotonic()
+
+        self.synth = synth
+        self.chan = chan
+        self.idle_wait = idle_wait
+
+        self.events = collections.deque()
+        self.wakeup = threading.Event()
+
+        # control states
+        self.scheduler_run = False
+        self.thread = None
+
+        # counts and latency distributions (seconds)
+        self.events_played = 0
+        self.queue_latencies = collections.deque(maxlen=stats_length)
+        self.total_latencies = collections.deque(maxlen=stats_length)
+        self.total_latency = total_latency
+
+    def push(self, timestamp, key, velocity, on):
+        self.events.append(SynthEvent(timestamp, key, velocity, on,
+                                      time.monotonic()))
+        self.wakeup.set()
+
+    def noteon(self, key, velocity, timestamp=None):
+        if timestamp is None:
+            timestamp = time.monotonic()
+        self.push(timestamp, key, velocity, True)
+
+    def noteoff(self, key, timestamp=None):
+        if timestamp is None:
+            timestamp = time.monotonic()
+        self.push(timestamp, key, 0, False)
+
+    def start(self):
+
+        # set run state
+        self.scheduler_run = True
+
+        # start thread
+        self.thread = threading.Thread(target=self.loop)
+        self.thread.start()
+
+    def stop(self):
+
+        # set loop kill state, the pending events are still played
+        self.scheduler_run = False
+        self.wakeup.set()
+
+        # let loop stop
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def loop(self):
+
+        while self.scheduler_run or self.events:
+            self.wakeup.wait(self.idle_wait)
+            # clear before draining: an event pushed meanwhile sets it again
+            self.wakeup.clear()
+            self.dispatch()
+
+    def dispatch(self):
+        # play all the queued events (also usable without the thread)
+        while self.events:
+            try:
+                event = self.events.popleft()
+            except IndexError:
+                break
+
+            if event.on:
+                self.synth.noteon(self.chan, event.key, event.velocity)
+            else:
+                self.synth.noteoff(self.chan, event.key)
+
+            played = time.monotonic()
+            self.events_played += 1
+            self.queue_latencies.append(played - event.pushed)
+            if self.total_latency:
+                self.total_latencies.append(played - event.timestamp)
+
+    def latency_stats(self):
+        # latency distributions, in milliseconds
+        stats = {'events': self.events_played}
+        for name, latencies in (('queue', self.queue_latencies),
+                                ('total', self.total_latencies)):
+            if latencies:
+                values = np.array(latencies) * 1000
+                stats[name + '_mean_ms'] = float(values.mean())
+                stats[name + '_p50_ms'], stats[name + '_p95_ms'], \
+                    stats[name + '_max_ms'] = \
+                    (float(v) for v in np.percentile(values, (50, 95, 100)))
+        return stats
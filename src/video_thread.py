@@ -12,8 +12,71 @@ Idea y código original:
 import time
 import threading
 import queue
+import collections
 import cv2
 import numpy as np
+from frame_ring import FrameRing
+from profiler import StageProfiler
+
+# ------------------------------
+# Frame Buffer
+# ------------------------------
+
+
+class FrameBuffer:
+
+    # Bounded FIFO shared by the capture thread and the consumer. Both sides
+    # sleep on a condition and are woken exactly when a frame lands, when
+    # space is freed or when the buffer is closed (shutdown or EOF).
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.items = collections.deque()
+        self.condition = threading.Condition()
+        self.closed = False
+
+    def qsize(self):
+        return len(self.items)
+
+    def empty(self):
+        return not self.items
+
+    def full(self):
+        return len(self.items) >= self.maxsize
+
+    def put(self, item, drop_oldest=False):
+        # drop_oldest: make room instead of overflowing (last frames mode)
+        with self.condition:
+            if drop_oldest:
+                while len(self.items) >= self.maxsize:
+                    self.items.popleft()
+            self.items.append(item)
+            self.condition.notify_all()
+
+    def wait_for_space(self, timeout=None):
+        # True when there is room for one more item, False if closed
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.closed or len(self.items) < self.maxsize,
+                timeout)
+            return not self.closed and len(self.items) < self.maxsize
+
+    def get(self, timeout=None):
+        # next item, queue.Empty if none arrives in timeout seconds or the
+        # buffer is closed and empty
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.items or self.closed, timeout)
+            if not self.items:
+                raise queue.Empty
+            item = self.items.popleft()
+            self.condition.notify_all()
+            return item
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
 
 # ------------------------------
 # Camera Tread
@@ -29,7 +92,12 @@ class VideoThread:
                  video_frame_rate=10,
                  buffer_all=False,
                  video_fourcc=cv2.VideoWriter_fourcc(*"MJPG"),
-                 try_to_reconnect=False):
+                 try_to_reconnect=False,
+                 shared_frames=False,
+                 held_frames=1,             # views a consumer keeps at once
+                 profiler=None,             # profiler.StageProfiler
+                 profile_name='capture',
+                 media_timestamps=False):
 
         self.video_source = video_source
         self.video_width = video_width
@@ -40,6 +108,21 @@ class VideoThread:
         self.buffer_all = buffer_all
         self.try_to_reconnect = try_to_reconnect
 
+        # decode into a shared memory ring of frames (see frame_ring), the
+        # buffer then carries sequence numbers instead of frames
+        self.shared_frames = shared_frames
+        self.held_frames = held_frames
+
+        # replay of files: the timestamps are the position of the frame in
+        # the file (frame number / frame rate) instead of the clock, so two
+        # files replayed as fast as possible still pair frame by frame
+        self.media_timestamps = media_timestamps
+
+        # grab and decode times, as <profile_name>.grab/.decode stages
+        self.profiler = profiler
+        self.profile_name = profile_name
+        if self.profiler is None:
+            self.profiler = StageProfiler(enabled=False)
 
 
         # ------------------------------
@@ -52,6 +135,10 @@ class VideoThread:
         # control states
         self.frame_grab_run = False
         self.frame_grab_on = False
+        self.thread = None
+
+        # set when the first frame is decoded (see wait_first_frame)
+        self.first_frame = threading.Event()
 
         # counts and amounts
         self.frame_count = 0
@@ -60,24 +147,26 @@ class VideoThread:
         self.loop_start_time = 0
         self.last_try_reconnection_time = 0
 
+        # time.monotonic() just after grabbing the last returned frame
+        self.frame_timestamp = 0.0
+        # ring sequence of the last returned frame (see is_frame_valid)
+        self.frame_seq = None
+
         # buffer
         if self.buffer_all:
-            self.buffer = queue.Queue(self.buffer_length)
+            self.buffer = FrameBuffer(self.buffer_length)
         else:
             # last frame only
-            self.buffer = queue.Queue(1)
+            self.buffer = FrameBuffer(1)
     
         self.finished = False
 
-        # camera setup
-        self.video_init_wait_time = 0.5
-
+        # camera setup (no settle sleep: consumers can wait_first_frame)
         self.resource = cv2.VideoCapture(self.video_source)
         self.resource.set(cv2.CAP_PROP_FRAME_WIDTH, self.video_width)
         self.resource.set(cv2.CAP_PROP_FRAME_HEIGHT, self.video_height)
         self.resource.set(cv2.CAP_PROP_FPS, self.video_frame_rate)
         self.resource.set(cv2.CAP_PROP_FOURCC, self.video_fourcc)
-        time.sleep(self.video_init_wait_time)
     
         if not self.resource.isOpened(): 
             self.resource_available = False
@@ -86,13 +175,27 @@ class VideoThread:
             # get the actual cam configuration 
             self.video_width = int(self.resource.get(cv2.CAP_PROP_FRAME_WIDTH))
             self.video_height = int(self.resource.get(cv2.CAP_PROP_FRAME_HEIGHT))
-            self.video_frame_rate = self.resource.get(cv2.CAP_PROP_FPS)
+            self.video_frame_rate = self.resource.get(cv2.CAP_PROP_FPS) or \
+                self.video_frame_rate
             self.video_fourcc = self.resource.get(cv2.CAP_PROP_FOURCC)
 
         # black frame (filler)
         self.black_frame = np.zeros((
             self.video_height, self.video_width, 3), np.uint8)
 
+        # shared frame ring: the buffered frames, the one being decoded
+        # and the ones the consumer holds (e.g. the stereo pairing pending
+        # items), a held view is still rewritten once the camera is that
+        # many frames ahead (see is_frame_valid)
+        if self.shared_frames:
+            self.frame_ring = FrameRing(
+                self.black_frame.shape,
+                n_slots=self.buffer.maxsize + 1 + self.held_frames)
+            self.black_frame_view = self.black_frame.view()
+            self.black_frame_view.flags.writeable = False
+        else:
+            self.frame_ring = None
+
     def get_curr_config_fps(self):
         return self.video_frame_rate
     
@@ -115,7 +218,11 @@ class VideoThread:
             video_height=self.video_height,
             video_frame_rate=self.video_frame_rate,
             video_fourcc=self.video_fourcc,
-            try_to_reconnect=self.try_to_reconnect
+            try_to_reconnect=self.try_to_reconnect,
+            shared_frames=self.shared_frames,
+            profiler=self.profiler,
+            profile_name=self.profile_name,
+            media_timestamps=self.media_timestamps
         )        
         
         self.start()
@@ -133,16 +240,24 @@ class VideoThread:
         self.thread = threading.Thread(target=self.loop)
         self.thread.start()
 
+    def wait_first_frame(self, timeout=None):
+        # True as soon as the first frame is decoded
+        return self.first_frame.wait(timeout)
+
     def stop(self):
 
         #print('########## stop')
 
-        # set loop kill state
+        # set loop kill state, wake up the loop if it waits for space
         self.frame_grab_run = False
+        if self.buffer is not None:
+            self.buffer.close()
 
         # let loop stop
-        while self.frame_grab_on:
-            time.sleep(0.1)
+        if self.thread is not None and \
+                self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
 
         # stop camera if not already stopped
         if self.resource:
@@ -156,15 +271,23 @@ class VideoThread:
         
         # drop buffer
         self.buffer = None
+        if self.frame_ring is not None:
+            self.frame_ring.close()
         # set recconection time
         self.last_try_reconnection_time = 0
 
     def loop(self):
 
-        # load start frame
-        frame = self.black_frame
-        if not self.buffer.full():
-            self.buffer.put(frame, False)
+        # load start frame (not in replays, only the file frames)
+        if not self.media_timestamps:
+            frame = self.black_frame
+            timestamp = time.monotonic()
+            if self.frame_ring is not None:
+                index, slot = self.frame_ring.write_slot()
+                slot[:] = frame
+                frame = self.frame_ring.commit(index, timestamp)
+            if not self.buffer.full():
+                self.buffer.put((timestamp, frame))
 
         # status
         self.frame_grab_on = True
@@ -174,42 +297,45 @@ class VideoThread:
         local_loop_frame_counter = 0
         local_loop_start_time = time.time()
 
-        while self.resource.grab():
-            # external shut down
-            if not self.frame_grab_run:
-                break
+        profiler = self.profiler
+        grab_stage = self.profile_name + '.grab'
+        decode_stage = self.profile_name + '.decode'
 
-            # true buffered mode (for files, no loss)
-            if self.buffer_all:
+        while self.frame_grab_run:
 
-                # buffer is full, pause and loop
-                if self.buffer.full():
-                    time.sleep(1/self.video_frame_rate)
+            # true buffered mode (for files, no loss): wait for space
+            # before grabbing, so no grabbed frame is dropped
+            if self.buffer_all and not self.buffer.wait_for_space():
+                break
 
-                # or load buffer with next frame
-                else:
-                    grabbed, frame = self.resource.retrieve()
-                    # grabbed, frame = self.resource.read()
-                    if not grabbed:
-                        break
-
-                    self.buffer.put(frame, False)
-                    self.frame_count += 1
-                    local_loop_frame_counter += 1
-            # false buffered mode (for camera, loss allowed)
+            grab_start = profiler.clock()
+            if not self.resource.grab():
+                break
+
+            # capture time, taken as close to the grab as possible
+            if self.media_timestamps:
+                timestamp = self.frame_count / self.video_frame_rate
             else:
-                grabbed, frame = self.resource.retrieve()
-                # grabbed, frame = self.resource.read()
-                if not grabbed:
-                    break
+                timestamp = time.monotonic()
+            profiler.record(grab_stage, grab_start)
+
+            # external shut down
+            if not self.frame_grab_run:
+                break
 
-                # open a spot in the buffer
-                if self.buffer.full():
-                    self.buffer.get()
+            with profiler.span(decode_stage):
+                grabbed, frame = self.retrieve(timestamp)
+            # grabbed, frame = self.resource.read()
+            if not grabbed:
+                break
 
-                self.buffer.put(frame, False)
-                self.frame_count += 1
-                local_loop_frame_counter += 1
+            # false buffered mode (for camera, loss allowed): the oldest
+            # frame makes room for the new one
+            self.buffer.put((timestamp, frame),
+                            drop_oldest=not self.buffer_all)
+            self.first_frame.set()
+            self.frame_count += 1
+            local_loop_frame_counter += 1
 
             # update frame read rate
             if local_loop_frame_counter >= 10:
@@ -225,17 +351,45 @@ class VideoThread:
         self.frame_grab_on = False
         self.resource_available = False
 
+        # wake up consumers waiting for a frame
+        self.buffer.close()
+
         
         # self.stop()
 
+    def retrieve(self, timestamp):
+        # decode the grabbed frame, into a ring slot with shared_frames
+        # (then the buffered value is the frame sequence number)
+        if self.frame_ring is None:
+            return self.resource.retrieve()
+
+        index, slot = self.frame_ring.write_slot()
+        grabbed, frame = self.resource.retrieve(image=slot)
+        if not grabbed:
+            return grabbed, None
+        if frame is not slot:
+            # decoder could not reuse the slot (different size or type)
+            slot[:] = frame
+        return grabbed, self.frame_ring.commit(index, timestamp)
+
+    def is_frame_valid(self, seq):
+        # False once the ring slot of frame seq (frame_seq after next) was
+        # rewritten, always True without shared_frames
+        if self.frame_ring is None:
+            return True
+        return seq is not None and self.frame_ring.is_valid(seq)
+
     def next(self, black=True, wait=0):
+        finished, _, frame = self.next_with_timestamp(black, wait)
+        return finished, frame
 
-        # black frame default
-        if black:
-            frame = self.black_frame.copy()
-        # no frame default
-        else:
-            frame = None
+    def next_with_timestamp(self, black=True, wait=0):
+        # as next, plus the capture time.monotonic() of the frame (None for
+        # the black frame)
+
+        # no frame default, the black frame is only made if needed
+        frame = None
+        timestamp = None
 
         # # can't open camera by index or loss connection or EOF
         # if not self.is_available(): 
@@ -248,8 +402,16 @@ class VideoThread:
             if self.is_available() or not self.buffer.empty(): 
                 try:
                     #print('\t########## self.buffer.qsize():{}'.format(self.buffer.qsize()))
-                    frame = self.buffer.get(timeout=wait)
-                    self.frames_returned += 1
+                    timestamp, frame = self.buffer.get(timeout=wait)
+                    if self.frame_ring is not None:
+                        # read-only view of the slot, None if overwritten
+                        self.frame_seq = frame
+                        frame = self.frame_ring.get(frame)
+                    if frame is not None:
+                        self.frames_returned += 1
+                        self.frame_timestamp = timestamp
+                    else:
+                        timestamp = None
                 except queue.Empty:
                     # print('Queue Empty!')
                     # print(traceback.format_exc())
@@ -273,4 +435,11 @@ class VideoThread:
     
             #print('\n')
 
-        return self.finished, frame
+        # black frame default
+        if frame is None and black:
+            if self.frame_ring is not None:
+                frame = self.black_frame_view
+            else:
+                frame = self.black_frame.copy()
+
+        return self.finished, timestamp, frame
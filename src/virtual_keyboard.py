@@ -18,140 +18,28 @@ from toolbox import round_half_up
 
 
 class VirtualKeyboard():
-    __white_map = {
-        0: 0,
-        1: 2,
-        2: 4,
-        3: 5,
-        4: 7,
-        5: 9,
-        6: 11,
-        7: 12,
-        8: 14,
-        9: 16,
-        10: 17,
-        11: 19,
-        12: 21,
-        13: 23,
-        14: 24,
-        15: 26,
-        16: 28,
-        17: 29,
-        18: 31,
-        19: 33,
-        20: 35,
-        21: 36,
-        22: 38,
-        23: 40,
-        24: 41,
-        25: 43,
-        26: 45,
-        27: 47
-    }
-
-    __black_map = {
-        0: 1,
-        1: 3,
-        2: None,
-        3: 6,
-        4: 8,
-        5: 10,
-        6: None,
-
-        7: 13,  # DO#
-        8: 15,
-        9: None,
-        10: 18,
-        11: 20,
-        12: 22,
-        13: None,
-
-        14: 25,
-        15: 27,
-        16: None,
-        17: 30,
-        18: 32,
-        19: 34,
-        20: None,
-
-        21: 37,
-        22: 39,
-        23: None,
-        24: 42,
-        25: 44,
-        26: 46,
-        27: None,
-
-        28: 49,
-        29: 51
-    }
-
-    __keyboard_piano_map = {  # Recomended set GM2 21-108
-        0:  36,  # DO
-        1:  37,  # DO#
-        2:  38,  # RE
-        3:  39,  # RE#
-        4:  40,  # MI
-        5:  41,  # FA
-        6:  42,  # FA#
-        7:  43,  # SOL
-        8:  44,  # SOL#
-        9:  45,  # LA
-        10: 46,  # LA#
-        11: 47,  # SI
-        12: 48,  # DO
-        13: 49,  # DO#
-        14: 50,  # RE
-        15: 51,  # RE#
-        16: 52,  # MI
-        17: 53,  # FA
-        18: 54,  # FA#
-        19: 55,  # SOL
-        20: 56,  # SOL#
-        21: 57,  # LA
-        22: 58,  # LA#
-        23: 59,  # SI
-        24: 60,  # DO
-        25: 61,  # DO#
-        26: 62,  # RE
-        27: 63,  # RE#
-        28: 64,  # MI
-        29: 65,  # FA
-        30: 66,  # FA#
-        31: 67,  # SOL
-        32: 68,  # SOL#
-        33: 69,  # LA
-        34: 70,  # LA#
-        35: 71,  # SI
-        36: 72,  # DO
-        37: 73,  # DO#
-        38: 74,  # RE
-        39: 75,  # RE#
-        40: 76,  # MI
-        41: 77,  # FA
-        42: 78,  # FA#
-        43: 79,  # SOL
-        44: 80,  # SOL#
-        45: 81,  # LA
-        46: 82,  # LA#
-        47: 83,  # SI
-        48: 84  # DO
-    }
+    # semitones of the white keys of an octave (DO RE MI FA SOL LA SI),
+    # the white keys 2 (MI) and 6 (SI) have no black key on their right
+    OCTAVE_WHITE_KEYS = (0, 2, 4, 5, 7, 9, 11)
+    OCTAVE_NO_BLACK = (2, 6)
+
+    # MIDI note of key 0 (DO), recomended set GM2 21-108
+    BASE_NOTE = 36
 
     def __init__(self, canvas_w, canvas_h, kb_white_n_keys):
         self.img = None
         self.canvas_w = canvas_w
         self.canvas_h = canvas_h
 
-        if self.canvas_w == 640 and self.canvas_h == 480:
-            # If camera are on the front of the user, the left keyboard
-            # image (on the right of the screen) must be centered at left
-            
-            self.kb_x0 = int(round_half_up(canvas_w * 0.20))  # 30
-            self.kb_y0 = int(round_half_up(canvas_h * 0.35))  # 50 + 100
+        # If camera are on the front of the user, the left keyboard
+        # image (on the right of the screen) must be centered at left
+        # (same proportions for any canvas size, 640x480 below)
+
+        self.kb_x0 = int(round_half_up(canvas_w * 0.20))  # 128
+        self.kb_y0 = int(round_half_up(canvas_h * 0.35))  # 168
 
-            self.kb_x1 = int(round_half_up(canvas_w * 0.80))  # 610
-            self.kb_y1 = int(round_half_up(canvas_h * 0.55))  # 190 + 100
+        self.kb_x1 = int(round_half_up(canvas_w * 0.80))  # 512
+        self.kb_y1 = int(round_half_up(canvas_h * 0.55))  # 264
 
         # print('Piano Coords: (x0,y0) (x1,y1): ({},{}) ({}, {})'.format(
         #     self.kb_x0, self.kb_y0, self.kb_x1, self.kb_y1))
@@ -175,14 +63,65 @@ class VirtualKeyboard():
         print('virtual_keyboard:black_key_heigth:{}'.
               format(self.black_key_heigth))
 
+        # white key position -> keyboard key (semitones from the first DO),
+        # and the black key on the right of each white key (None if none,
+        # nor after the last DO: n_bank * 5 black keys)
+        self.__white_map = {}
+        self.__black_map = {}
+        for p in range(kb_white_n_keys):
+            octave, degree = divmod(p, 7)
+            key = 12 * octave + self.OCTAVE_WHITE_KEYS[degree]
+            self.__white_map[p] = key
+            last = p == kb_white_n_keys - 1
+            self.__black_map[p] = None \
+                if degree in self.OCTAVE_NO_BLACK or last else key + 1
+
         self.keys_without_black = \
-            list({none_keys for none_keys in self.__black_map
-                  if self.__black_map[none_keys] is None})
+            [p for p in self.__black_map if self.__black_map[p] is None]
 
         self.key_id = None
         self.rectangle = []
         self.upper_zone_divisions = []
 
+        # Key geometry index, built once: the black keys are kept as sorted
+        # (x0, x1) pixel intervals so find_key is a binary search
+        self.black_key_y1 = int(round_half_up(self.kb_y0 +
+                                              self.black_key_heigth))
+        for p in range(self.kb_white_n_keys):
+            if p not in self.keys_without_black:
+                b_bk_x0, b_bk_x1 = self.black_key_bounds(p)
+                self.upper_zone_divisions.append(
+                    self.new_key(p,
+                                 (b_bk_x0, self.kb_y0),
+                                 (b_bk_x1, self.black_key_y1)))
+        self.upper_zone_divisions = tuple(self.upper_zone_divisions)
+
+        self.black_keys_x0 = np.array(
+            [k[1][0][0] for k in self.upper_zone_divisions], dtype=np.int32)
+        self.black_keys_x1 = np.array(
+            [k[1][1][0] for k in self.upper_zone_divisions], dtype=np.int32)
+        self.black_keys_id = np.array(
+            [k[0] for k in self.upper_zone_divisions], dtype=np.int32)
+        # keyboard key of each white key and of each black key interval
+        self.white_keys_key = np.array(
+            [self.__white_map[p] for p in range(self.kb_white_n_keys)],
+            dtype=np.int32)
+        self.black_keys_key = np.array(
+            [self.__black_map[int(p)] for p in self.black_keys_id],
+            dtype=np.int32)
+        for index_array in (self.black_keys_x0, self.black_keys_x1,
+                            self.black_keys_id, self.white_keys_key,
+                            self.black_keys_key):
+            index_array.flags.writeable = False
+
+        # cached keyboard overlay (see draw_virtual_keyboard)
+        self.highlight_color = (0, 165, 255)
+        self._overlay_key = None
+        self._overlay_roi = None
+        self._overlay_bgr = None
+        self._overlay_alpha = None
+        self._overlay_beta = None
+
     def new_key(self, key_id, top_left, bottom_rigth):
         self.key_id = key_id
         self.rectangle = [top_left, bottom_rigth]
@@ -190,70 +129,126 @@ class VirtualKeyboard():
 
     # def add_key_key_upper_zone(self):
 
-    def draw_virtual_keyboard(self, img):
-        # TODO: Mejorar esto para hacerlo solo una vez
-        # Prepara shapes
-        # Initialize blank mask image of same dimensions for drawing the shapes
-        shapes = np.zeros_like(img, np.uint8)
+    def black_key_bounds(self, p):
+        # x0, x1 of the black key to the right of the white key p
+        x_line_pos = self.kb_x0 + self.white_key_width * (p+1)
+        if p % 7 in (0, 3):
+            b_bk_x0 = int(round_half_up(
+                x_line_pos - self.black_key_width*(2/3)))
+            b_bk_x1 = int(round_half_up(
+                x_line_pos + self.black_key_width*(1/3)))
+        elif p % 7 in (1, 5):
+            b_bk_x0 = int(round_half_up(
+                x_line_pos - self.black_key_width*(1/3)))
+            b_bk_x1 = int(round_half_up(
+                x_line_pos + self.black_key_width*(2/3)))
+        else:
+            b_bk_x0 = int(round_half_up(
+                x_line_pos - self.black_key_width/2))
+            b_bk_x1 = int(round_half_up(
+                x_line_pos + self.black_key_width/2))
+        return b_bk_x0, b_bk_x1
+
+    def draw_virtual_keyboard(self, img, highlighted_keys=None):
+        # The keyboard is rendered once into a cached BGR + alpha layer
+        # that only covers the keyboard region of interest (ROI); each
+        # frame just blends that ROI. The layer is rebuilt when the canvas
+        # size, the geometry or the highlighted keys change.
+        if highlighted_keys:
+            highlighted_keys = frozenset(highlighted_keys)
+        else:
+            highlighted_keys = frozenset()
+
+        overlay_key = (img.shape[:2],
+                       (self.kb_x0, self.kb_y0, self.kb_x1, self.kb_y1,
+                        self.kb_white_n_keys),
+                       highlighted_keys)
+        if overlay_key != self._overlay_key:
+            self._build_overlay(img.shape[0], img.shape[1], highlighted_keys)
+            self._overlay_key = overlay_key
+
+        y0, y1, x0, x1 = self._overlay_roi
+        roi = img[y0:y1, x0:x1]
+        cv2.blendLinear(roi, self._overlay_bgr,
+                        self._overlay_beta, self._overlay_alpha, dst=roi)
+
+    def _build_overlay(self, img_h, img_w, highlighted_keys):
+        layer = np.zeros((img_h, img_w, 3), np.uint8)
+        coverage = np.zeros((img_h, img_w), np.uint8)
+
+        # Keys, lines and labels are drawn over black and, with the same
+        # shapes, into a coverage mask (antialiased text gives partial
+        # coverage)
+        self._draw_keys(layer, highlighted_keys)
+        self._draw_keys(coverage, highlighted_keys, mask=True)
+        coverage = coverage.astype(np.float32) / 255
+
+        # The keyboard background is a white rectangle blended at 50% below
+        # the shapes
+        alpha = 0.5  # Alpha transparency
+        background = np.zeros((img_h, img_w), np.float32)
         cv2.rectangle(
-            img=shapes,
+            img=background,
             pt1=(self.kb_x0, self.kb_y0),
             pt2=(self.kb_x1, self.kb_y1),
-            color=(255, 255, 255),
+            color=alpha,
             thickness=cv2.FILLED)
+        background *= 1 - coverage
+
+        overlay_alpha = coverage + background
+        premultiplied = layer.astype(np.float32) + \
+            (background * 255)[..., np.newaxis]
+
+        # Crop everything to the bounding box of the painted pixels
+        ys, xs = np.nonzero(overlay_alpha)
+        y0, y1 = int(ys.min()), int(ys.max()) + 1
+        x0, x1 = int(xs.min()), int(xs.max()) + 1
+
+        overlay_alpha = overlay_alpha[y0:y1, x0:x1]
+        premultiplied = premultiplied[y0:y1, x0:x1]
+        overlay_bgr = premultiplied / \
+            np.maximum(overlay_alpha, 1e-6)[..., np.newaxis]
+
+        self._overlay_roi = (y0, y1, x0, x1)
+        self._overlay_bgr = np.clip(
+            np.rint(overlay_bgr), 0, 255).astype(np.uint8)
+        self._overlay_alpha = np.ascontiguousarray(overlay_alpha)
+        self._overlay_beta = 1.0 - self._overlay_alpha
+
+    def _draw_keys(self, img, highlighted_keys, mask=False):
+        # With mask=True every shape is painted with 255 on a single
+        # channel image, to know which pixels of the layer are opaque
+        def paint(color):
+            return 255 if mask else color
+
+        # Draw black keys
+        for p, b_bk_x0, b_bk_x1 in zip(self.black_keys_id,
+                                       self.black_keys_x0,
+                                       self.black_keys_x1):
+            if self.__black_map[int(p)] in highlighted_keys:
+                bk_color = self.highlight_color
+            else:
+                bk_color = (0, 0, 0)
 
-        # Generate output by blending image with shapes image, using the shapes
-        # images also as mask to limit the blending to those parts
-        alpha = 0.5  #   Alpha transparency
-        mask = shapes.astype(bool)
-        img[mask] = cv2.addWeighted(img, alpha, shapes, 1 - alpha, 0)[mask]
+            cv2.rectangle(
+                img=img,
+                pt1=(int(b_bk_x0), self.kb_y0),
+                pt2=(int(b_bk_x1), self.black_key_y1),
+                color=paint(bk_color),
+                thickness=cv2.FILLED)
 
         for p in range(self.kb_white_n_keys):
             x_line_pos = self.kb_x0 + self.white_key_width * (p+1)
 
-            # Draw black keys
-
-            if p not in self.keys_without_black:
-                if p in (0, 3, 7, 10, 14, 17):
-                    b_bk_x0 = int(round_half_up(
-                        x_line_pos - self.black_key_width*(2/3)))
-                    b_bk_x1 = int(round_half_up(
-                        x_line_pos + self.black_key_width*(1/3)))
-                elif p in (1, 5, 8, 12, 15, 19):
-                    b_bk_x0 = int(round_half_up(
-                        x_line_pos - self.black_key_width*(1/3)))
-                    b_bk_x1 = int(round_half_up(
-                        x_line_pos + self.black_key_width*(2/3)))
-                else:
-                    b_bk_x0 = int(round_half_up(
-                        x_line_pos - self.black_key_width/2))
-                    b_bk_x1 = int(round_half_up(
-                        x_line_pos + self.black_key_width/2))
-
-                key_coord = \
-                    self.new_key(p,
-                                 (b_bk_x0, self.kb_y0),
-                                 (b_bk_x1,
-                                  int(
-                                      round_half_up(self.kb_y0 +
-                                                    self.black_key_heigth))))
-                self.upper_zone_divisions.append(key_coord)
-
-                cv2.rectangle(
-                    img=img,
-                    pt1=(b_bk_x0, self.kb_y0),
-                    pt2=(b_bk_x1, int(
-                        round_half_up(self.kb_y0 + self.black_key_heigth))),
-                    color=(0, 0, 0),
-                    thickness=cv2.FILLED)
-
             cv2.line(img=img,
                      pt1=(int(round_half_up(x_line_pos)), self.kb_y0),
                      pt2=(int(round_half_up(x_line_pos)), self.kb_y1),
-                     color=(0, 0, 0),
+                     color=paint((0, 0, 0)),
                      thickness=2)
 
-            if p != 7:  # Do central
+            if self.__white_map[p] in highlighted_keys:
+                c_color = self.highlight_color
+            elif p != 7:  # Do central
                 c_color = (0, 255, 0)
             else:
                 c_color = (0, 0, 0)
@@ -262,7 +257,7 @@ class VirtualKeyboard():
                        center=(int(x_line_pos - self.white_key_width/2),
                                int(self.kb_y0 + self.white_kb_height*3/4)),
                        radius=7,
-                       color=c_color,
+                       color=paint(c_color),
                        thickness=cv2.FILLED
                        )
 
@@ -273,10 +268,10 @@ class VirtualKeyboard():
                                 self.kb_y0 + self.white_kb_height*3/4))+3),
                         fontFace=cv2.FONT_HERSHEY_DUPLEX,
                         fontScale=0.4,
-                        color=(0, 0, 255))
+                        color=paint((0, 0, 255)))
 
         cv2.rectangle(img, (self.kb_x0, self.kb_y0),
-                      (self.kb_x1, self.kb_y1), (255, 0, 0), 2)
+                      (self.kb_x1, self.kb_y1), paint((255, 0, 0)), 2)
 
     def intersect(self, pointXY):
         if pointXY[0] > self.kb_x0 and pointXY[0] < self.kb_x1 and \
@@ -295,19 +290,12 @@ class VirtualKeyboard():
     def find_key_in_upper_zone(self, x_kb_pos, y_kb_pos):
         # print('find_key_in_upper_zone:x_pos:{}'.format(x_kb_pos))
 
-        key_id = -1
-        for k in self.upper_zone_divisions:
-            if x_kb_pos > k[1][0][0] and x_kb_pos < k[1][1][0]:
-
-                # print('k:{}'.format(k))
-                # print('k[0]:{}'.format(k[0]))
-                # print('k[1][0][0]:{}'.format(k[1][0][0]))
-                # print('k[1][1][0]:{}'.format(k[1][1][0]))
-
-                key_id = k[0]
-                # print('Key_id:{}'.format(key_id))
-                break
-        return key_id
+        # last black key starting at the left of x_kb_pos
+        i = int(np.searchsorted(self.black_keys_x0, x_kb_pos,
+                                side='left')) - 1
+        if i >= 0 and x_kb_pos < self.black_keys_x1[i]:
+            return int(self.black_keys_id[i])
+        return -1
 
     def find_key(self, x_pos, y_pos):
         # print('find_key:x_pos {}'.format(x_pos))
@@ -317,25 +305,41 @@ class VirtualKeyboard():
         y = y_pos - self.kb_y0
 
         if y < self.black_key_heigth:
-            key = x/self.white_key_width*2
-            key = math.floor(key)
-
             key = self.find_key_in_upper_zone(x_pos, y_pos)
             # print('find_key:upper zone key {}'.format(key))
-            if key == -1:
-                key = x/self.white_key_width
-                # print('find_key:key {}'.format(key))
-                key = math.floor(key)
-                # print('find_key:ceil key {}'.format(key))
-                return self.__white_map[int(key)]
-            else:
-                return self.__black_map[int(key)]
-        else:
-            key = x/self.white_key_width
-            # print('find_key:key {}'.format(key))
-            key = math.floor(key)
-            # print('find_key:ceil key {}'.format(key))
-            return self.__white_map[int(key)]
+            if key != -1:
+                return self.__black_map[key]
+
+        key = x/self.white_key_width
+        # print('find_key:key {}'.format(key))
+        key = math.floor(key)
+        # print('find_key:ceil key {}'.format(key))
+        return self.__white_map[int(key)]
+
+    def find_keys(self, points_xy):
+        # Vectorized intersect + find_key: points_xy is a (N,2) array of
+        # pixel positions, returns a (N,) array of keys, -1 when the point
+        # is outside the keyboard
+        points_xy = np.asarray(points_xy, dtype=np.float64).reshape(-1, 2)
+        x = points_xy[:, 0]
+        y = points_xy[:, 1]
+
+        inside = (x > self.kb_x0) & (x < self.kb_x1) & \
+            (y > self.kb_y0) & (y < self.kb_y1)
+
+        white = np.floor((x - self.kb_x0) / self.white_key_width)
+        white = np.clip(white, 0, self.kb_white_n_keys - 1).astype(np.intp)
+        keys = self.white_keys_key[white]
+
+        black = np.searchsorted(self.black_keys_x0, x, side='left') - 1
+        in_black = (black >= 0) & \
+            (y - self.kb_y0 < self.black_key_heigth)
+        black = np.clip(black, 0, None)
+        in_black &= x < self.black_keys_x1[black]
+
+        keys = np.where(in_black, self.black_keys_key[black], keys)
+        keys[~inside] = -1
+        return keys
 
     def note_from_key(self, key):
-        return self.__keyboard_piano_map[key]
+        return self.BASE_NOTE + int(key)
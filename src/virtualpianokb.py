@@ -51,7 +51,6 @@ Fuentes:
 
 
 # TODOES:
-# TODO1: Crear una cola (queue) para estabilizar con un promedio la posición xy de los dedos
 # TODO2: Calcular distancia angular para detectar cuando un dedo está bajo el umbral para tocar la tecla virtual
 # TODO3: Incluir todos los dedos al mapa de XY + Depth
 # TODO4: Mejorar performance, primera opcion GPU, y optimización
@@ -59,20 +58,34 @@ Fuentes:
 @author: mherrera
 """
 
+import sys
 import time
+import json
+import argparse
+import collections
 import traceback
 import cv2
 
 import video_thread as video_thread
-#import calibration as calibration
+import calibration as calibration
 import angles as angles
 
 import handdetector
+import detection_thread
+import stereo_pairing
+import hand_matching
+import landmark_filter
+import synth_scheduler
+import note_velocity
+import profiler
+import frame_preprocess
+import display_thread
+import detection_process
+import pipeline_config
 from toolbox import round_half_up
 import virtual_keyboard as vkb
 import keyboard_mapper as kbm
 import numpy as np
-import fluidsynth
 import math
 
 def frame_add_crosshairs(frame,
@@ -94,7 +107,44 @@ def frame_add_crosshairs(frame,
     cv2.circle(frame, (x, y), r, cc, cw)
 
 
-def main():
+# data of a main loop cycle for the preview (see compose_preview)
+PreviewFrame = collections.namedtuple(
+    'PreviewFrame',
+    ['left_result',     # detection_thread.DetectionResult
+     'right_result',
+     'target',          # (x, y) index fingertip, left frame
+     'text'])           # dashboard, None if hidden
+
+
+def shared_frame_source(cam):
+    # stereo pairing source of (ring sequence, frame view) items of a
+    # VideoThread with shared_frames, the sequence tells if the view was
+    # rewritten before it was used (see DetectionThread.process)
+    def source(wait):
+        finished, timestamp, frame = cam.next_with_timestamp(black=False,
+                                                             wait=wait)
+        if frame is None:
+            return finished, timestamp, None
+        return finished, timestamp, (cam.frame_seq, frame)
+    return source
+
+
+def main(config=None):   # pipeline_config, the defaults if None
+
+    # Cameras are devices (int). Video files or image sequences (e.g.
+    # camcalibration/images/stereoL/img-%04d.png) are replayed frame by
+    # frame, without loss and as fast as possible; headless replays run
+    # without window nor audio device (null synth), printing the notes and
+    # the stage profile, for benchmarks and regressions.
+
+    if config is None:
+        config = pipeline_config.default_config()
+    config = pipeline_config.resolve(config)
+    print('config:{}'.format(pipeline_config.dumps(config)))
+    headless = config['display']['headless']
+    profile_file = config['profile']['file']
+    # exit status: 1 if the run ended by an error
+    failed = False
 
     try:
 
@@ -103,15 +153,15 @@ def main():
         # ------------------------------
 
         # cameras variables
-        left_camera_source = 2   # Left Camera in Camrea Point of View (PoV)
-        right_camera_source = 0  # Right Camera in Camrea Point of View (PoV)
-        pixel_width = 640
-        pixel_height = 480
+        replay = config['replay']
+        pixel_width = config['cameras']['width']
+        pixel_height = config['cameras']['height']
 
         # Logi C920s HD Pro Webcam
-        camera_hFoV = 70.42  # Horizontal Field of View
-        camera_vFoV = 43.3   # Vertical Field of View
-        hFoV_angle_rectification = 21.42 # Field of View (FoV) rectifcation
+        camera_hFoV = config['cameras']['h_fov']  # Horizontal Field of View
+        camera_vFoV = config['cameras']['v_fov']  # Vertical Field of View
+        # Field of View (FoV) rectifcation
+        hFoV_angle_rectification = config['cameras']['h_fov_rectification']
         vFoV_angle_rectification = \
             camera_vFoV * hFoV_angle_rectification/camera_hFoV
 
@@ -119,16 +169,28 @@ def main():
         angle_height = camera_vFoV - vFoV_angle_rectification
 
         # FPS
-        frame_rate = 30
-        camera_separation = 14.21 # cms
+        frame_rate = config['cameras']['frame_rate']
+        camera_separation = config['cameras']['separation'] # cms
 
-        camera_in_front_of_you = True
+        camera_in_front_of_you = config['cameras']['in_front_of_you']
+
+        # With multiprocess_detection each camera is captured and detected
+        # in its own process (see detection_process), only the landmarks
+        # come back; otherwise cameras and detection are threads of this
+        # process
+        multiprocess_detection = config['detection']['multiprocess']
+
+        # per stage latency profile (p50/p95 on the dashboard with 'p'),
+        # saved at exit to profile_file (.json or .csv) if set
+        profile = config['profile']['enabled']
+        stage_profiler = profiler.StageProfiler(enabled=profile)
 
         # TODO: Better if is calculated in te setup with a image in the 
         # virtual center of the stereo image
         
         # Virtual Keyboard Center point distance (cms)
-        vkb_center_point_camera_dist = 71 # 66.8
+        vkb_center_point_camera_dist = \
+            config['keyboard']['center_point_distance'] # 66.8
 
             # cam_resource = video_thread.VideoThread(
             #     video_source=c_id,
@@ -139,39 +201,65 @@ def main():
             #     try_to_reconnect=False
             # )
         # left camera 1
-        cam_left = video_thread.VideoThread(
-            video_source=left_camera_source,
-            video_width=pixel_width,
-            video_height=pixel_height,
-            video_frame_rate=frame_rate,
-            buffer_all=False,
-            try_to_reconnect=False)
-
-        # right camera 2
-        cam_right = video_thread.VideoThread(
-            video_source=right_camera_source,
+        left_video_config = dict(
+            video_source=config['cameras']['left'],
             video_width=pixel_width,
             video_height=pixel_height,
             video_frame_rate=frame_rate,
-            buffer_all=False,
-            try_to_reconnect=False)
-
-        # start cameras
-        cam_left.start()
-        cam_right.start()
-
-        time.sleep(1)
+            buffer_all=config['cameras']['buffer_all'],
+            try_to_reconnect=config['cameras']['try_to_reconnect'],
+            media_timestamps=replay)
+        right_video_config = dict(left_video_config,
+                                  video_source=config['cameras']['right'])
+
+        # With pipelined_detection each camera is detected in its own
+        # thread, so both detections overlap and the main loop only takes
+        # the latest result of each one (replays detect every pair in the
+        # main loop instead, no result is dropped). Detection processes
+        # are always pipelined.
+        pipelined_detection = multiprocess_detection or \
+            config['detection']['pipelined']
+
+        # unmatched items the stereo pairing keeps per camera; without
+        # pipelined detection they are frame views of the camera rings,
+        # which then hold them and the pair being detected
+        stereo_max_pending = 4
+        held_frames = 1 if pipelined_detection else stereo_max_pending + 1
+
+        if multiprocess_detection:
+            # opened by the detection processes
+            cam_left = None
+            cam_right = None
+        else:
+            cam_left = video_thread.VideoThread(
+                shared_frames=True,
+                held_frames=held_frames,
+                profiler=stage_profiler,
+                profile_name='left.capture',
+                **left_video_config)
+
+            # right camera 2
+            cam_right = video_thread.VideoThread(
+                shared_frames=True,
+                held_frames=held_frames,
+                profiler=stage_profiler,
+                profile_name='right.capture',
+                **right_video_config)
+
+            # start cameras
+            cam_left.start()
+            cam_right.start()
+
+            # wait (at most 1 second) for the first frames
+            cam_left.wait_first_frame(timeout=1)
+            cam_right.wait_first_frame(timeout=1)
         if camera_in_front_of_you:
             main_window_name = 'In fron of you: rigth+left cam'
         else:
             main_window_name = 'Same Point of View: left+rigth cam'
 
-        cv2.namedWindow(main_window_name)
-        cv2.moveWindow(main_window_name,
-                       (pixel_width//2),
-                       (pixel_height//2))        
         
-        if cam_left.is_available():
+        if cam_left is not None and cam_left.is_available():
             print('Name:{}'.format(main_window_name))
             print('cam_left.resource.get(cv2.CAP_PROP_AUTO_EXPOSURE:{}'.
                   format(cam_left.resource.get(cv2.CAP_PROP_AUTO_EXPOSURE)))
@@ -190,7 +278,7 @@ def main():
                   format(cam_left.resource.get(cv2.CAP_PROP_FRAME_COUNT)))
                 
 
-        if cam_right.is_available():
+        if cam_right is not None and cam_right.is_available():
             print('Name:{}'.format(main_window_name))
             print('cam_right.resource.get(cv2.CAP_PROP_AUTO_EXPOSURE:{}'.
                   format(cam_right.resource.get(cv2.CAP_PROP_AUTO_EXPOSURE)))
@@ -227,7 +315,7 @@ def main():
         # set up virtual keyboards
         # ------------------------------
 
-        N_BANK = 3
+        N_BANK = config['keyboard']['n_bank']
         N_MAYOR_NOTES_X_BANK = 7
 
         # KEYBOARD_WHIITE_N_KEYS + 1 agrega el ultimo DO
@@ -235,7 +323,7 @@ def main():
 
         KEYBOARD_TOT_KEYS = KEYBOARD_WHIITE_N_KEYS + N_BANK * 5
         print('KEYBOARD_TOT_KEYS:{}'.format(KEYBOARD_TOT_KEYS))
-        octave_base = 0
+        octave_base = config['keyboard']['octave_base']
 
         vk_left = vkb.VirtualKeyboard(pixel_width, pixel_height,
                                       KEYBOARD_WHIITE_N_KEYS)
@@ -254,27 +342,195 @@ def main():
         # cameras are the same, so only 1 needed
         angler = angles.Frame_Angles(pixel_width, pixel_height, angle_width,
                                      angle_height)
-        angler.build_frame()
+        angler.build_frame(angle_tables=True)
+
+        # left/right hand correspondence
+        hand_matcher = hand_matching.HandMatcher()
+
+        # ------------------------------
+        # set up detection workers
+        # ------------------------------
 
-        left_detector = handdetector.HandDetector(staticImageMode=False,
-                                                  detectionCon=0.75,
-                                                  trackCon=0.5)
-        right_detector = handdetector.HandDetector(staticImageMode=False,
-                                                   detectionCon=0.75,
-                                                   trackCon=0.5)
+        # ---- Cameras Calibration ----
+        # undistort and rectify with camcalibration/stereo_calibration.npz
+        # (python src/calibration.py), opt-in: the press threshold and the
+        # angle normalization are tuned with the nominal model. With
+        # 'landmarks' only the fingertips are rectified, just before
+        # triangulation, and the frames (detection and display) stay as
+        # captured; with 'frames' the whole frames are remapped with the
+        # precomputed maps.
+        stereo_rectifier = calibration.load()
+        if stereo_rectifier is not None and \
+                stereo_rectifier.image_size != (pixel_width, pixel_height):
+            print('calibration:image size {} is not {}x{}, not used'.format(
+                stereo_rectifier.image_size, pixel_width, pixel_height))
+            stereo_rectifier = None
+        rectification = config['detection']['rectification']
+        rectify_frames = stereo_rectifier is not None and \
+            rectification == 'frames'
+        rectify_landmarks = stereo_rectifier is not None and \
+            rectification == 'landmarks'
+
+        # rectified frames and points are in the calibrated model (P1/P2
+        # intrinsics and baseline), not in the nominal field of view
+        if rectify_frames or rectify_landmarks:
+            fx, fy, cx, cy, camera_separation = \
+                stereo_rectifier.rectified_camera(flipped=True)
+            angler.set_camera_matrix(fx, fy, cx, cy, angle_tables=True)
+            print('calibration:rectified camera:fx:{:.1f} fy:{:.1f} '
+                  'cx:{:.1f} cy:{:.1f} separation:{:.2f}'.format(
+                      fx, fy, cx, cy, camera_separation))
+
+        # Detect only around the virtual keyboard (plus a margin for the
+        # rest of the hand), following the hands when they move out of it
+        detection_roi = config['detection']['roi']
+        detection_roi_margin = config['detection']['roi_margin']
+        detection_scale = config['detection']['scale']
+
+        # Optionally (detection.frame_skipping), run mediapipe only every
+        # few frames when the box can not keep frame_rate, following the
+        # landmarks with optical flow in between
+        detection_frame_skipping = config['detection']['frame_skipping']
+        detection_max_interval = config['detection']['max_interval']
+
+        # (also sent to the detection processes)
+        detector_config = {
+            'init': dict(staticImageMode=False,
+                         img_width=pixel_width,
+                         img_height=pixel_height,
+                         detectionCon=config['detection']['detection_con'],
+                         trackCon=config['detection']['track_con']),
+            'roi': dict(x0=vk_left.kb_x0, y0=vk_left.kb_y0,
+                        x1=vk_left.kb_x1, y1=vk_left.kb_y1,
+                        margin=detection_roi_margin,
+                        scale=detection_scale,
+                        tracking=True) if detection_roi else None,
+            'frame_skipping': dict(maxInterval=detection_max_interval,
+                                   targetRate=frame_rate)
+            if detection_frame_skipping else None}
+
+        # the right camera sees the keyboard f*B/Z pixels to the left (the
+        # disparity, flipped frames), its base region is shifted as much
+        right_detector_config = dict(detector_config)
+        if detection_roi:
+            keyboard_disparity = int(round_half_up(
+                angler.x_adjacent * camera_separation /
+                vkb_center_point_camera_dist))
+            right_detector_config['roi'] = dict(
+                detector_config['roi'],
+                x0=vk_left.kb_x0 - keyboard_disparity,
+                x1=vk_left.kb_x1 - keyboard_disparity)
+            print('detection:right roi shift:{}'.format(-keyboard_disparity))
+
+        # with multiprocess_detection these only draw the hands (no
+        # mediapipe graph in this process)
+        left_detector = handdetector.HandDetector(
+            inference=not multiprocess_detection, **detector_config['init'])
+        right_detector = handdetector.HandDetector(
+            inference=not multiprocess_detection, **detector_config['init'])
+        for detector, side_config in ((left_detector, detector_config),
+                                      (right_detector, right_detector_config)):
+            if side_config['roi'] is not None:
+                detector.setRoi(**side_config['roi'])
+            if side_config['frame_skipping'] is not None:
+                detector.setFrameSkipping(**side_config['frame_skipping'])
+
+        if multiprocess_detection:
+            # capture, preprocessing and detection of each camera in its
+            # own process; replays wait for the main loop (lossless)
+            left_worker = detection_process.DetectionProcess(
+                'left', left_video_config, detector_config,
+                frame_shape=(pixel_height, pixel_width, 3),
+                fingertips_index=left_detector.fingerTipsIndex,
+                rectify='left' if rectify_frames else None,
+                n_slots=config['detection']['process_slots'],
+                lossless=replay,
+                profiler=stage_profiler)
+            right_worker = detection_process.DetectionProcess(
+                'right', right_video_config, right_detector_config,
+                frame_shape=(pixel_height, pixel_width, 3),
+                fingertips_index=right_detector.fingerTipsIndex,
+                rectify='right' if rectify_frames else None,
+                n_slots=config['detection']['process_slots'],
+                lossless=replay,
+                profiler=stage_profiler)
+            left_worker.start()
+            right_worker.start()
+
+            # both up (mediapipe takes a few seconds) before playing
+            for worker in (left_worker, right_worker):
+                if not worker.wait_ready(timeout=30):
+                    raise RuntimeError(
+                        'detection process {} not ready'.format(worker.name))
+
+            # frame rate and detection stats (dashboard)
+            left_capture, right_capture = left_worker, right_worker
+            left_stats, right_stats = left_worker, right_worker
+        else:
+            # rectification (optional) and selfie point of view flip, into
+            # preallocated frames (more than the stereo pairing can hold)
+            preprocess_left = frame_preprocess.FramePreprocessor(
+                cam_left.black_frame.shape, flip_code=-1,
+                rectify=stereo_rectifier.rectify_left if rectify_frames
+                else None)
+            preprocess_right = frame_preprocess.FramePreprocessor(
+                cam_right.black_frame.shape, flip_code=-1,
+                rectify=stereo_rectifier.rectify_right if rectify_frames
+                else None)
+
+            left_worker = detection_thread.DetectionThread(
+                left_detector, cam_left, preprocess=preprocess_left,
+                profiler=stage_profiler, profile_name='left.detection')
+            right_worker = detection_thread.DetectionThread(
+                right_detector, cam_right, preprocess=preprocess_right,
+                profiler=stage_profiler, profile_name='right.detection')
+
+            if pipelined_detection:
+                left_worker.start()
+                right_worker.start()
+
+            # frame rate and detection stats (dashboard)
+            left_capture, right_capture = cam_left, cam_right
+            left_stats, right_stats = left_detector, right_detector
+
+        # ------------------------------
+        # set up stereo pairing
+        # ------------------------------
+
+        # left and right are only used together if they were captured
+        # within stereo_max_skew seconds
+        stereo_max_skew = 0.5/frame_rate
+
+        if pipelined_detection:
+            stereo_pairs = stereo_pairing.StereoPairing(
+                left_worker.next_with_timestamp,
+                right_worker.next_with_timestamp,
+                max_skew=stereo_max_skew,
+                max_pending=stereo_max_pending)
+        else:
+            stereo_pairs = stereo_pairing.StereoPairing(
+                shared_frame_source(cam_left),
+                shared_frame_source(cam_right),
+                max_skew=stereo_max_skew,
+                max_pending=stereo_max_pending)
 
         # ------------------------------
         # set up synth
         # ------------------------------
 
-        fs = fluidsynth.Synth()
-        fs.start(driver='alsa') # Linux
+        if headless:
+            fs = synth_scheduler.NullSynth(verbose=True)
+        else:
+            import fluidsynth
+            fs = fluidsynth.Synth()
+        fs.start(driver=config['synth']['driver']) # Linux: alsa
         # sfid = fs.sfload("/home/mherrera/Proyectos/Desa/\
         #                  00400-VirtualPianoKeyboard/0100-lab/example.sf2")
-        sfid = fs.sfload("/usr/share/sounds/sf2/FluidR3_GM.sf2")
+        sfid = fs.sfload(config['synth']['soundfont'])
 
-        # 000-000 Yamaha Grand Piano
-        fs.program_select(chan=0, sfid=sfid, bank=0, preset=0)
+        # 000-000 Yamaha Grand Piano (default)
+        fs.program_select(chan=0, sfid=sfid, bank=config['synth']['bank'],
+                          preset=config['synth']['preset'])
 
         # # 008-014 Church Bell
         # fs.program_select(chan=0, sfid=sfid, bank=8, preset=14)
@@ -285,17 +541,29 @@ def main():
         # # 000-103 Star Theme
         # fs.program_select(chan=0, sfid=sfid, bank=0, preset=103)
 
-        # ------------------------------
-        # stabilize
-        # ------------------------------
-        time.sleep(0.5)
+        # the notes are played by their own thread, the main loop only
+        # queues them (replays: media timestamps, no capture to synth
+        # latency)
+        synth = synth_scheduler.SynthScheduler(fs, chan=0,
+                                               total_latency=not replay)
+        synth.start()
 
         # variables
         # ------------------------------
 
-        # length of target queues, positive target frames required
-        # to reset set X,Y,Z,D
-        queue_len = 3
+        # fingertip tracks filter (One-Euro), 5 tips x 2 hands, predicting
+        # prediction_horizon seconds ahead (about the camera-to-sound
+        # latency)
+        n_tips = len(left_detector.fingerTips)
+        finger_filter = landmark_filter.OneEuroFilterBank(
+            n_tracks=2 * n_tips, n_values=6,
+            positive=(3,))      # D: distance to the cameras
+        prediction_horizon = 1 / frame_rate
+
+        # note on velocity from the speed of each fingertip track towards
+        # the keyboard
+        velocity_estimator = note_velocity.VelocityEstimator(
+            n_tracks=2 * n_tips)
 
         # target queues
         #fingers_left_queue, y1k = [], []
@@ -315,130 +583,64 @@ def main():
 
         cycles = 0
         fps = 0
+        skew_p95 = 0
+        audio_p95 = 0
         start = time.time()
+        run_start = start
         display_dashboard = True
-        while True:
-            cycles += 1
-            # get frames
-            finished_left, frame_left = cam_left.next(black=True, wait=0.5)
-            finished_right, frame_right = cam_right.next(black=True, wait=0.5)
+        display_profile = False
 
-            # if not finished_left:
-            #     cv2.imshow('TEST-l', frame_left)
-            # if not finished_right:
-            #     cv2.imshow('TEST-r', frame_right)
-
-
-            # #################################################################
-            # # # ---- Cameras Calibration ----
-            # frame_left, frame_right = calibration.undistortRectify(
-            #       frame_left, frame_right)
-            # #################################################################
-
-            frame_left = cv2.flip(frame_left, -1)  # Selfie point of view
-            frame_right = cv2.flip(frame_right, -1)  # Selfie point of view
-
-            hands_left_image = fingers_left_image = []
-            hands_right_image = fingers_right_image = []
+        # ------------------------------
+        # set up preview (own thread)
+        # ------------------------------
 
-            # Detect Hands
-            if left_detector.findHands(frame_left):
-                vk_left.draw_virtual_keyboard(frame_left)
-                left_detector.drawHands(frame_left)
-                left_detector.drawTips(frame_left)
-                
-                hands_left_image, fingers_left_image = \
-                    left_detector.getFingerTipsPos()
+        display_max_fps = config['display']['max_fps']
+        h_frames = None     # display canvas, allocated once
+
+        def compose_preview(preview):
+            # side by side canvas with the keyboard, hands, targets and
+            # dashboard (display thread)
+            nonlocal h_frames
+            frame_left = preview.left_result.frame
+            frame_right = preview.right_result.frame
+            display_shape = (frame_left.shape[0],
+                             frame_left.shape[1] + frame_right.shape[1], 3)
+            if h_frames is None or h_frames.shape != display_shape:
+                h_frames = np.empty(display_shape, np.uint8)
+            if camera_in_front_of_you:
+                width = frame_right.shape[1]
+                h_frames[:, :width] = frame_right
+                h_frames[:, width:] = frame_left
+                frame_left = h_frames[:, width:]
+                frame_right = h_frames[:, :width]
             else:
-                vk_left.draw_virtual_keyboard(frame_left)
-
-            if right_detector.findHands(frame_right):
+                width = frame_left.shape[1]
+                h_frames[:, :width] = frame_left
+                h_frames[:, width:] = frame_right
+                frame_left = h_frames[:, :width]
+                frame_right = h_frames[:, width:]
+
+            vk_left.draw_virtual_keyboard(frame_left)
+            if preview.left_result.found:
+                left_detector.drawHands(frame_left,
+                                        preview.left_result.landmarks)
+                left_detector.drawTips(frame_left,
+                                       preview.left_result.landmarks)
+            if preview.right_result.found:
                 #vk_right.draw_virtual_keyboard(frame_right)
-                right_detector.drawHands(frame_right)
-                right_detector.drawTips(frame_right)
-
-                hands_right_image, fingers_right_image = \
-                    right_detector.getFingerTipsPos()
-            # else:
-            #     vk_right.draw_virtual_keyboard(frame_right)
-
-            # check 1: motion in both frames:
-            if (len(fingers_left_image) > 0 and len(fingers_right_image) > 0):
-
-                fingers_dist = []
-                for finger_left, finger_right in \
-                    zip(fingers_left_image, fingers_right_image):
-                    # print('finger_left:{}'.format(finger_left))
-                    # print('finger_right:{}'.format(finger_right))
-                    # get angles from camera centers
-                    xlangle, ylangle = angler.angles_from_center(
-                        x = finger_left[2], y = finger_left[3],
-                        top_left=True, degrees=True)
-                    xrangle, yrangle = angler.angles_from_center(
-                        x = finger_right[2], y = finger_right[3],
-                        top_left=True, degrees=True)
-
-                    # triangulate
-                    X_local, Y_local, Z_local, D_local = angler.location(
-                        camera_separation,
-                        (xlangle, ylangle),
-                        (xrangle, yrangle),
-                        center=True,
-                        degrees=True)
-                    # angle normalization
-                    delta_y = 0.006509695290859 * X_local * X_local + \
-                        0.039473684210526 * -1 * X_local # + vkb_center_point_camera_dist
-                    fingers_dist.append(D_local-delta_y)
-                    # if finger_left[0] == 0 and 
-                    if finger_left[0] == 0 and finger_left[1] == left_detector.mpHands.HandLandmark.INDEX_FINGER_TIP:
-                        x_left_finger_screen_pos =  finger_left[2]
-                        y_left_finger_screen_pos = finger_left[3]
-                        X = X_local
-                        Y = Y_local
-                        Z = Z_local
-                        D = D_local
-                        
-
-                on_map, off_map = km.get_kayboard_map(
-                    virtual_keyboard=vk_left,
-                    fingertips_pos=fingers_left_image,
-                    fingers_height=fingers_dist,
-                    center_point_distance=vkb_center_point_camera_dist-2.5,
-                    keyboard_n_key=KEYBOARD_TOT_KEYS)
-
-                if np.any((on_map == True)):
-                    for k_pos, on_key in enumerate(on_map):
-                        # print('k_pos:{}   on_key:{}'.format(k_pos, on_key))
-                        if on_key:
-                            # kb.press(keyboard_map[k_pos])
-                            fs.noteon(
-                                chan=0,
-                                key=vk_left.note_from_key(k_pos)+octave_base,
-                                vel=127*2//3)
-
-                if np.any((off_map == True)):
-                    for k_pos, off_key in enumerate(off_map):
-                        # print('k_pos:{}   off_key:{}'.format(k_pos, off_key))
-                        if off_key:
-                            # kb.release(keyboard_map[k_pos])
-                            fs.noteoff(
-                                chan=0,
-                                key=vk_left.note_from_key(k_pos)+octave_base
-                                )
+                right_detector.drawHands(frame_right,
+                                         preview.right_result.landmarks)
+                right_detector.drawTips(frame_right,
+                                        preview.right_result.landmarks)
 
             # display camera centers
             angler.frame_add_crosshairs(frame_left)
             angler.frame_add_crosshairs(frame_right)
 
-            if display_dashboard:
-                # Display dashboard data
-                fps1 = int(cam_left.current_frame_rate)
-                fps2 = int(cam_right.current_frame_rate)
-                cps_avg = int(round_half_up(fps))  # Average Cycles per second
-                text = 'X: {:3.1f}\nY: {:3.1f}\nZ: {:3.1f}\nD: {:3.1f}\nDr: {:3.1f}\nFPS:{}/{}\nCPS:{}'.format(X, Y, Z, D, D-delta_y, fps1, fps2, cps_avg)
+            if preview.text is not None:
                 lineloc = 0
                 lineheight = 30
-                for t in text.split('\n'):
+                for t in preview.text.split('\n'):
                     lineloc += lineheight
                     cv2.putText(frame_left,
                                 t,
@@ -450,34 +652,195 @@ def main():
                                 2,                          # line width
                                 cv2.LINE_AA,
                                 False)
+                if display_profile:
+                    # p50/p95 of every stage, right side
+                    lineloc = 0
+                    for t in stage_profiler.overlay_lines():
+                        lineloc += lineheight // 2
+                        cv2.putText(frame_right, t, (10, lineloc),
+                                    cv2.FONT_HERSHEY_PLAIN, 1.0,
+                                    (0, 255, 0), 1, cv2.LINE_AA, False)
 
             # Display current target
-            # if fingers_left_queue:
-            #     frame_add_crosshairs(frame_left, x1m, y1m, 24)
-            #     frame_add_crosshairs(frame_right, x2m, y2m, 24)
-
-            # if fingers_left_queue:
-            #     frame_add_crosshairs(frame_left, x1m, y1m, 24)
-            #     frame_add_crosshairs(frame_right, x2m, y2m, 24)
-            # if X > 0 and Y > 0:
-            frame_add_crosshairs(frame_left, x_left_finger_screen_pos, y_left_finger_screen_pos, 24)
+            frame_add_crosshairs(frame_left, *preview.target, 24)
             # Pendiente : ...frame_add_crosshairs(frame_right, x_left_finger_screen_pos, y_left_finger_screen_pos, 24)
+            return h_frames
 
+        if not headless:
+            display = display_thread.DisplayThread(
+                main_window_name, compose_preview,
+                max_fps=display_max_fps,
+                position=(pixel_width//2, pixel_height//2),
+                profiler=stage_profiler)
+            display.start()
 
-
-            # Display frames
-
-            # cv2.imshow(left_window_name, frame_left)
-            # cv2.imshow(right_window_name, frame_right)
-
-            if camera_in_front_of_you:
-                h_frames = np.concatenate((frame_right, frame_left), axis=1)
+        while True:
+            cycles += 1
+            cycle_start = stage_profiler.clock()
+            # get a stereo pair of frames and detect hands
+            with stage_profiler.span('pairing'):
+                finished, stereo_pair = stereo_pairs.next(wait=0.5)
+            if replay and finished and stereo_pair is None:
+                # end of the files
+                break
+            if stereo_pair is None:
+                left_result = left_worker.empty_result()
+                right_result = right_worker.empty_result()
+            elif pipelined_detection:
+                _, _, left_result, right_result = stereo_pair
             else:
-                h_frames = np.concatenate((frame_left, frame_right), axis=1)
+                left_ts, right_ts, left_frame, right_frame = stereo_pair
+                left_result = left_worker.process(left_frame[1], left_ts,
+                                                  left_frame[0])
+                right_result = right_worker.process(
+                    right_frame[1], right_ts, right_frame[0]) \
+                    if left_result is not None else None
+                if left_result is None or right_result is None:
+                    # a frame rewritten by its camera before being copied
+                    left_result = left_worker.empty_result()
+                    right_result = right_worker.empty_result()
+
+            # if not finished:
+            #     cv2.imshow('TEST-l', frame_left)
+            #     cv2.imshow('TEST-r', frame_right)
 
-            cv2.imshow(main_window_name, h_frames)
+            hands_left_image = left_result.handedness
+            fingers_left_image = left_result.fingertips
+            hands_right_image = right_result.handedness
+            fingers_right_image = right_result.fingertips
+
+
+            # check 1: the same hands in both frames:
+            stage_start = stage_profiler.clock()
+            hand_pairs = hand_matcher.match_hands(
+                left_result.landmarks, hands_left_image,
+                right_result.landmarks, hands_right_image)
+            stage_profiler.record('matching', stage_start)
+            on_keys, off_keys = kbm.NO_KEYS, kbm.NO_KEYS
+            if hand_pairs:
+
+                # pair the fingertips of the matched hands and triangulate
+                # them all at once
+                stage_start = stage_profiler.clock()
+                fingers_left, fingers_right = hand_matcher.match_fingertips(
+                    fingers_left_image, fingers_right_image, hand_pairs)
+
+
+                if rectify_landmarks:
+                    triangulate_left = stereo_rectifier.rectify_points_left(
+                        fingers_left[:, 2:4], flipped=True)
+                    triangulate_right = \
+                        stereo_rectifier.rectify_points_right(
+                            fingers_right[:, 2:4], flipped=True)
+                else:
+                    triangulate_left = fingers_left[:, 2:4]
+                    triangulate_right = fingers_right[:, 2:4]
+
+                locations = angler.locations_from_pixels(
+                    camera_separation,
+                    triangulate_left,
+                    triangulate_right,
+                    center=True)
+                stage_profiler.record('triangulation', stage_start)
+
+                # smooth the tracks (X,Y,Z,D + screen x,y) and predict them
+                # one frame ahead; a track is a fingertip of the left or
+                # right hand (by handedness; if both got the same label, by
+                # wrist x in the left frame, the detection order can swap)
+                stage_start = stage_profiler.clock()
+                left_hand_ids = [left_id for left_id, _ in hand_pairs]
+                hand_slots = hands_left_image[left_hand_ids, 0]
+                if len(set(hand_slots)) < len(hand_slots):
+                    wrists_x = left_result.landmarks[left_hand_ids, 0, 0]
+                    hand_slots = np.argsort(np.argsort(wrists_x))
+                hand_slot = dict(zip(left_hand_ids, hand_slots))
+                track_ids = [
+                    int(hand_slot[hand_id]) * n_tips + tip_order
+                    for hand_id, tip_order in zip(
+                        fingers_left[:, 0],
+                        np.searchsorted(left_detector.fingerTipsIndex,
+                                        fingers_left[:, 1]))]
+
+                tracks = finger_filter.update(
+                    track_ids,
+                    np.column_stack((locations, fingers_left[:, 2:4])),
+                    left_result.timestamp)
+
+                # tracks without estimate (no valid triangulation yet) out
+                valid = np.isfinite(tracks).all(axis=1)
+                if not valid.all():
+                    track_ids = [track_id for track_id, ok
+                                 in zip(track_ids, valid) if ok]
+                    tracks = tracks[valid]
+                    fingers_left = fingers_left[valid]
+                predicted = finger_filter.predict(track_ids,
+                                                  prediction_horizon)
+                locations = tracks[:, 0:4]
+                fingers_xy = tracks[:, 4:6]
+
+                # angle normalization (predicted distance, so the key is
+                # pressed when the finger gets there, not a frame later)
+                X_local = predicted[:, 0]
+                delta_ys = 0.006509695290859 * X_local * X_local + \
+                    0.039473684210526 * -1 * X_local # + vkb_center_point_camera_dist
+                fingers_dist = predicted[:, 3] - delta_ys
+
+                fingers_velocity = velocity_estimator.update(
+                    track_ids, locations[:, 3], left_result.timestamp)
+                stage_profiler.record('filter', stage_start)
+
+                # if finger_left[0] == 0 and
+                index_tips = np.nonzero(
+                    (fingers_left[:, 0] == 0) &
+                    (fingers_left[:, 1] ==
+                     left_detector.mpHands.HandLandmark.INDEX_FINGER_TIP))[0]
+                if index_tips.size > 0:
+                    i = index_tips[-1]
+                    x_left_finger_screen_pos = fingers_xy[i, 0]
+                    y_left_finger_screen_pos = fingers_xy[i, 1]
+                    X, Y, Z, D = locations[i]
+                if delta_ys.size > 0:
+                    delta_y = delta_ys[-1]
+
+                stage_start = stage_profiler.clock()
+                on_keys, off_keys = km.get_key_changes(
+                    virtual_keyboard=vk_left,
+                    fingertips_xy=fingers_xy,
+                    fingers_height=fingers_dist,
+                    center_point_distance=vkb_center_point_camera_dist-2.5,
+                    keyboard_n_key=KEYBOARD_TOT_KEYS,
+                    fingers_velocity=fingers_velocity)
+                stage_profiler.record('keymap', stage_start)
 
+            elif stereo_pair is not None:
+                # no hands over the keyboard: release the pressed keys
+                on_keys, off_keys = km.get_key_changes(
+                    virtual_keyboard=vk_left,
+                    fingertips_xy=kbm.NO_KEYS,
+                    fingers_height=kbm.NO_KEYS,
+                    center_point_distance=vkb_center_point_camera_dist-2.5,
+                    keyboard_n_key=KEYBOARD_TOT_KEYS)
 
+            # only the keys that changed
+            stage_start = stage_profiler.clock()
+            for k_pos, velocity in zip(on_keys, km.on_velocity):
+                # kb.press(keyboard_map[k_pos])
+                synth.noteon(
+                    key=vk_left.note_from_key(k_pos)+octave_base,
+                    velocity=int(velocity),
+                    timestamp=left_result.timestamp)
+
+            for k_pos in off_keys:
+                # kb.release(keyboard_map[k_pos])
+                synth.noteoff(
+                    key=vk_left.note_from_key(k_pos)+octave_base,
+                    timestamp=left_result.timestamp)
+            stage_profiler.record('synth', stage_start)
+
+            if headless:
+                # nothing to display
+                stage_profiler.record('cycle', cycle_start)
+                continue
 
             if (cycles % 10 == 0):
                 # End time
@@ -488,15 +851,37 @@ def main():
                 # Calculate frames per second
                 fps = 10 / seconds
                 start = time.time()
+                # stereo skew (95th percentile)
+                skew_p95 = stereo_pairs.skew_stats().get('p95_ms', 0)
+                # capture to synth call latency (95th percentile), push to
+                # synth call in replays
+                audio_p95 = synth.latency_stats().get(
+                    'queue_p95_ms' if replay else 'total_p95_ms', 0)
+
+            # Display frames (the display thread draws them)
+            if display_dashboard:
+                # Display dashboard data
+                fps1 = int(left_capture.current_frame_rate)
+                fps2 = int(right_capture.current_frame_rate)
+                cps_avg = int(round_half_up(fps))  # Average Cycles per second
+                text = 'X: {:3.1f}\nY: {:3.1f}\nZ: {:3.1f}\nD: {:3.1f}\nDr: {:3.1f}\nFPS:{}/{}\nCPS:{}\nSkew:{:3.1f}ms\nAudio:{:3.1f}ms\nN:{}/{}'.format(X, Y, Z, D, D-delta_y, fps1, fps2, cps_avg, skew_p95, audio_p95, left_stats.skip_interval, right_stats.skip_interval)
+            else:
+                text = None
+            display.show(PreviewFrame(
+                left_result, right_result,
+                (x_left_finger_screen_pos, y_left_finger_screen_pos),
+                text))
+            stage_profiler.record('cycle', cycle_start)
 
             # Detect control keys
-            key = cv2.waitKey(1) & 0xFF
-            if cv2.getWindowProperty(
-                    main_window_name, cv2.WND_PROP_VISIBLE) < 1:
+            key = display.next_key()
+            if display.closed:
                 break
             # elif cv2.getWindowProperty(
             #         right_window_name, cv2.WND_PROP_VISIBLE) < 1:
             #     break
+            elif key is None:
+                pass
             elif key == ord('q'):
                 break
             elif key == ord('d'):
@@ -504,24 +889,81 @@ def main():
                     display_dashboard = False
                 else:
                     display_dashboard = True
-            elif key != 255:
+            elif key == ord('p'):
+                display_profile = not display_profile
+            else:
                 print('KEY PRESS:', [chr(key)])
 
     # ------------------------------
     # full error catch
     # ------------------------------
+    except KeyboardInterrupt:
+        # Ctrl-C: same shutdown (the detection processes ignore SIGINT and
+        # wait for their stop event)
+        print('interrupted')
     except Exception:
         print(traceback.format_exc())
+        failed = True
 
     # ------------------------------
     # close all
     # ------------------------------
 
-    # Fluidsynth
+    # close the preview
+    try:
+        display.stop()
+        print('display:shown:{} dropped:{}'.format(
+            display.frames_shown, display.frames_dropped))
+    except Exception:
+        pass
+    # synth thread (plays the pending events) and Fluidsynth
+    try:
+        synth.stop()
+        print('synth latency:{}'.format(synth.latency_stats()))
+    except Exception:
+        pass
     try:
         fs.delete()
     except Exception:
         pass
+    # inferred/propagated frames
+    try:
+        print('detection:left:{}'.format(left_stats.getFrameStats()))
+        print('detection:right:{}'.format(right_stats.getFrameStats()))
+        if not multiprocess_detection:
+            print('detection:stale frames left:{} right:{}'.format(
+                left_worker.frames_stale, right_worker.frames_stale))
+    except Exception:
+        pass
+    # stop detection workers (threads or processes)
+    try:
+        left_worker.stop()
+    except Exception:
+        pass
+    try:
+        right_worker.stop()
+    except Exception:
+        pass
+    # latency profile
+    try:
+        seconds = time.time() - run_start
+        print('run:cycles:{} seconds:{:.2f} cps:{:.1f}'.format(
+            cycles, seconds, cycles / seconds))
+        print('config:{}'.format(pipeline_config.dumps(config)))
+        # paired and dropped (never paired) results of each camera
+        print('pairing:{}'.format(stereo_pairs.skew_stats()))
+        for stage, stats in stage_profiler.stats().items():
+            print('profile:{}:{}'.format(stage, stats))
+        if profile_file:
+            saved = stage_profiler.dump(
+                profile_file,
+                config=config,
+                run={'cycles': cycles, 'seconds': seconds},
+                pairing=stereo_pairs.skew_stats(),
+                synth=synth.latency_stats())
+            print('profile:saved:{}'.format(' '.join(saved)))
+    except Exception:
+        pass
     # close camera1
     try:
         cam_left.stop()
@@ -534,11 +976,10 @@ def main():
     except Exception:
         pass
 
-    # kill frames
-    cv2.destroyAllWindows()
 
     # done
-    print('DONE')
+    print('DONE' if not failed else 'FAILED')
+    return 1 if failed else 0
 
 
 # ------------------------------
@@ -546,4 +987,16 @@ def main():
 # ------------------------------
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Virtual Piano Keyboard')
+    pipeline_config.add_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        run_config = pipeline_config.from_args(args)
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+
+    if args.print_config:
+        print(json.dumps(run_config, indent=2, sort_keys=True))
+    else:
+        sys.exit(main(run_config))